@@ -25,10 +25,9 @@ class HullPaintingRobot(object):
 
     def __init__(self, program_file):
 
-        self.proc = IntCodeProcessor(name='Robot', is_async=True)
+        self.proc = IntCodeProcessor(name='Robot', is_async=True, output_capacity=2)
         self.input_queue = queue.Queue()
         self.proc.attach_input_queue(self.input_queue)
-        self.output_queue = self.proc.get_output_queue()
         
         self.painted_panels = defaultdict(lambda: 0)
         self.panel_coords = (0,0)
@@ -69,17 +68,18 @@ class HullPaintingRobot(object):
         current_panel_colour = initial_panel_colour
         moves_made = 0
 
-        while self.proc.running:
+        # Each panel colour input gives a colour and turn output, until the processor halts
+        # instead of producing an output
+        while True:
 
             self.input_queue.put(current_panel_colour)
-            try:
-                (colour, turn) = (self.output_queue.get(timeout=1.0), self.output_queue.get(timeout=1.0))
-            except queue.Empty:
-                if self.proc.running:
-                    raise RunTimeError("ROBOT processor timed out")
-                else:
-                    logging.debug("ROBOT processor halted")
-                    break
+            colour = self.proc.get_output()
+            if colour is None:
+                logging.debug("ROBOT processor halted")
+                break
+            turn = self.proc.get_output()
+            if turn is None:
+                raise RuntimeError("ROBOT processor halted without a turn")
 
             logging.debug("ROBOT got instructions: colour {} turn {}".format(
                 colour, turn
@@ -93,6 +93,8 @@ class HullPaintingRobot(object):
             moves_made += 1
             current_panel_colour = self.painted_panels[self.panel_coords]            
 
+        self.proc.run_thread.join()
+
         return (moves_made, len(self.painted_panels))
 
     def show_registration(self):
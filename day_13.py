@@ -10,23 +10,23 @@ from intcode import IntCodeProcessor
 class BreakoutGame(object):
 
     Tiles = ['.', u'\u2588', '#', '=', 'o']
+
+    InstructionBudget = 10000
     
     def __init__(self):
         
-        self.proc = IntCodeProcessor(name='Breakout')
+        self.proc = IntCodeProcessor(name='Breakout', engine=IntCodeProcessor.Engine.JIT)
 
         self.tiles = {}
         self.score = -1
 
-        self.output_data = []
-
     def load_file(self, file_name):
 
         self.proc.load_file(file_name)
 
     def enable_free_play(self):
 
-        self.proc.memory[0] = 2
+        self.proc.set_memory(0, 2)
 
     def run(self, interactive=False):
 
@@ -47,13 +47,10 @@ class BreakoutGame(object):
             self.tiles_output = 0
             self.initialized = False
 
-            def store_output(output_val):
-                self.output_data.append(output_val)
+            def process_frames(frames):
 
-            def process_output():
-                
-                for idx in range(0, len(self.output_data), 3):
-                    (x, y, tile_id) = self.output_data[idx:idx+3]
+                # Process the batch of (x, y, tile) triples output since the last batch
+                for (x, y, tile_id) in frames:
 
                     if x == -1 and y == 0:
                         self.score = tile_id
@@ -72,23 +69,24 @@ class BreakoutGame(object):
                             if self.initialized:
                                 self.display()
 
-            def handle_input():
+            def joystick_position():
 
-                process_output()
                 if self.paddle_pos > self.ball_pos:
-                    joystick = -1
+                    return -1
                 elif self.paddle_pos == self.ball_pos:
-                    joystick = 0
+                    return 0
                 else:
-                    joystick = 1
-                
-                self.output_data.clear()
-                return joystick
-
-            self.proc.attach_input_method(handle_input)
-            self.proc.attach_output_method(store_output)
-            self.proc.run()
-            process_output()
+                    return 1
+
+            # Run the game in slices of instructions, the output being delivered in batches of
+            # triples between them, and provide the joystick position when the game requests input
+            self.proc.attach_frame_method(process_frames, frame_size=3)
+            while True:
+                status = self.proc.run(max_instructions=self.InstructionBudget)
+                if status == self.proc.Status.HALTED:
+                    break
+                if status == self.proc.Status.NEEDS_INPUT:
+                    self.proc.load_inputs([joystick_position()])
 
     def get_num_blocks(self):
 
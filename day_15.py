@@ -7,7 +7,7 @@ import queue
 import sys
 import time
 
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from intcode import IntCodeProcessor
 
@@ -156,6 +156,66 @@ class RepairDroid():
         print("Walk completed, oxygen system is at {}".format(self.oxygen_coords))
         
     
+    def explore(self):
+
+        # Explore the area breadth-first from the origin. The droid program state is
+        # snapshotted when it is suspended needing the move after reaching each new location,
+        # and each unexplored neighbour is tried by restoring that snapshot and making a single
+        # move, rather than walking the droid there
+
+        def store_statuses(statuses):
+            self.output_data.extend(status for (status,) in statuses)
+
+        def run_to_next_input(moves):
+
+            self.output_data.clear()
+            self.proc.load_inputs(moves)
+            self.proc.run()
+            if self.proc.status != self.proc.Status.NEEDS_INPUT:
+                raise RuntimeError("Droid program stopped with status {}".format(
+                    self.proc.status.name
+                ))
+            self.move_snapshot = self.proc.snapshot()
+
+        self.proc.attach_input_method(None)
+        self.proc.attach_frame_method(store_statuses, frame_size=1)
+
+        run_to_next_input([])
+
+        self.tiles[self.coords] = self.Tile.EMPTY
+        self.visited.add(self.coords)
+        pending = deque([(self.coords, self.move_snapshot)])
+
+        while pending:
+
+            (coords, snapshot) = pending.popleft()
+
+            for direction in self.Direction:
+
+                neighbour = tuple(
+                    [sum(elems) for elems in zip(coords, self.MoveDelta[direction])]
+                )
+                if neighbour in self.tiles:
+                    continue
+
+                self.proc.restore(snapshot)
+                run_to_next_input([direction])
+
+                status = self.output_data[0]
+                if status == self.Output.WALL:
+                    self.tiles[neighbour] = self.Tile.WALL
+                    continue
+
+                self.tiles[neighbour] = self.Tile.EMPTY
+                self.visited.add(neighbour)
+                if status == self.Output.OXYGEN:
+                    self.oxygen_coords = neighbour
+
+                pending.append((neighbour, self.move_snapshot))
+
+        self.display(self.Output.OXYGEN, False)
+        print("Exploration completed, oxygen system is at {}".format(self.oxygen_coords))
+
     def find_shortest_path(self):
 
         return self.breadth_first((0,0), self.oxygen_coords)
@@ -265,7 +325,7 @@ class RepairDroid():
 
 def part1(droid):
 
-    droid.walk()
+    droid.explore()
     shortest_path = droid.find_shortest_path()
     logging.info("Part 1: shortest path length to oxygen system is {}".format(shortest_path))
 
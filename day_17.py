@@ -30,15 +30,13 @@ class AsciiRobot():
 
     def draw(self):
 
+        # The camera image is delivered as a batch of newline-terminated rows, ending with an
+        # empty row
+        def store_rows(rows):
+            self.scaffold.extend(list(row) for row in rows if len(row))
+
+        self.proc.attach_frame_method(store_rows, delimiter=self.CRLF)
         self.proc.run()
-        
-        row = []
-        for elem in  self.proc.get_outputs():
-            if elem == self.CRLF and len(row):
-                self.scaffold.append(copy.deepcopy(row))
-                row.clear()
-            else:
-                row.append(elem)
 
         self.rows = len(self.scaffold)
         self.cols = len(self.scaffold[0])
@@ -88,7 +86,7 @@ class AsciiRobot():
 
     def run(self, input):
 
-        self.proc.memory[0] = 2
+        self.proc.set_memory(0, 2)
         self.proc.load_inputs(input)
         self.proc.run()
         
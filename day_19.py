@@ -8,6 +8,7 @@ import time
 import numpy as np
 
 from intcode import IntCodeProcessor
+from intcode_analysis import find_input_prefix
 
 class TractorBeamDrone():
     
@@ -19,30 +20,34 @@ class TractorBeamDrone():
 
         self.proc.load_file(file_name)
 
+        # Beam probes start from the state after the part of the program which runs the same
+        # whatever point is probed
+        prefix = find_input_prefix(self.proc.program)
+        logging.debug("Drone program input-independent prefix is {} instructions".format(
+            prefix.num_instructions
+        ))
+        self.proc.attach_prefix(*prefix)
+
     def profile_beam(self):
 
         max_x = 50
         max_y = 50
 
-        self.beam = np.empty((max_y, max_x), dtype=int)
+        # Probe every point in the grid in a single batch run of the drone program
+        points = [(x, y) for y in range(max_y) for x in range(max_x)]
+        outputs = self.proc.run_batch(points)
 
-        for x in range(max_x):
-            for y in range(max_y):
-                
-                self.proc.reset_memory()
-                self.proc.load_inputs([x,y])
-                self.proc.run()
-                self.beam[y][x] = self.proc.get_outputs()[0]
+        self.beam = np.array([output[0] for output in outputs], dtype=int).reshape(
+            (max_y, max_x)
+        )
         
         return np.sum(self.beam)
 
     def is_in_beam(self, x, y):
 
-        self.proc.reset_memory()
-        self.proc.load_inputs([x, y])
-        self.proc.run()
-        
-        return self.proc.get_outputs()[0]
+        # The drone program is a pure function of the point, and the fit finder probes many
+        # points repeatedly, so the outputs are memoized
+        return self.proc.run_function((x, y))[0]
 
     def display_beam(self):
 
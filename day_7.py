@@ -1,10 +1,13 @@
 # AOC day 7
 
+import asyncio
 import itertools
 import logging
+import queue
 import sys
+import time
 
-from intcode import IntCodeProcessor
+from intcode import AsyncIntCodeProcessor, IntCodeProcessor, RingBufferChannel, Scheduler
 
 def find_max_thrust(proc):
 
@@ -14,14 +17,12 @@ def find_max_thrust(proc):
 
         amp_input = 0
 
+        # Each amplifier stage is a pure function of its phase and input, which repeat across
+        # permutations, so the outputs are memoized
         for amp in range(5):
             
-            proc.load_inputs([phase_sequence[amp], amp_input])
-            proc.run()
-            thrust = proc.get_outputs()[0]
-            
+            thrust = proc.run_function((phase_sequence[amp], amp_input))[0]
             amp_input = thrust
-            proc.reset_memory()
 
         thrust_signal[thrust] = phase_sequence
 
@@ -80,16 +81,23 @@ def part1():
     ))
 
 
-def find_max_thrust_feedback(test_program=None, program_file=None):
+def find_max_thrust_feedback(test_program=None, program_file=None, is_async=False,
+    channel_type=queue.Queue):
 
     num_procs = 5
     proc_names = ["A", "B", "C", "D", "E"]
     procs = []
     thrust_signal = {}
 
-    # Create processors
+    # Create processors, passing values between them through channels of the specified type
+    # if running asynchronously
     for idx in range(num_procs):
-        procs.append(IntCodeProcessor(name=proc_names[idx], is_async=True))
+        procs.append(IntCodeProcessor(
+            name=proc_names[idx], is_async=is_async, channel_type=channel_type
+        ))
+
+    if not is_async:
+        return find_max_thrust_cooperative(procs, test_program, program_file)
 
     # Attach output queue of processor to next, and load program from appropriate source
     for idx in range(num_procs):
@@ -137,6 +145,95 @@ def find_max_thrust_feedback(test_program=None, program_file=None):
     ))
     return (max_thrust_signal, max_phase_sequence)
 
+def find_max_thrust_cooperative(procs, test_program=None, program_file=None):
+
+    num_procs = len(procs)
+    thrust_signal = {}
+
+    # Connect the output of each processor to the input of the next in a scheduler, and load
+    # program from appropriate source
+    scheduler = Scheduler(procs)
+    for idx in range(num_procs):
+
+        scheduler.connect(procs[idx], procs[(idx+1) % num_procs])
+        if test_program:
+            procs[idx].load_program(test_program)
+        elif program_file:
+            procs[idx].load_file(program_file)
+        else:
+            raise RuntimeError("No program input source specified")
+
+    # Loop over all permutations of phase inputs sequences
+    for phase_sequence in itertools.permutations([5,6,7,8,9]):
+
+        # Load the phase sequence element into the inputs of each processor, priming the
+        # initial input value of the first processor
+        for (idx, phase) in enumerate(phase_sequence):
+            procs[idx].reset_memory()
+            procs[idx].load_inputs([phase, 0] if idx == 0 else [phase])
+
+        # Run the processors in the scheduler until all have halted
+        scheduler.run()
+
+        # Get the final thrust value output by the last processor into the input of the first
+        thrust = procs[0].inputs.pop()
+        thrust_signal[thrust] = phase_sequence
+
+    max_thrust_signal = max(thrust_signal.keys())
+    max_phase_sequence = thrust_signal[max_thrust_signal]
+    
+    logging.debug("Found max thrust signal {} for phase sequence {}".format(
+        max_thrust_signal, ','.join([str(phase) for phase in max_phase_sequence])
+    ))
+    return (max_thrust_signal, max_phase_sequence)
+
+def find_max_thrust_asyncio(test_program=None, program_file=None):
+
+    num_procs = 5
+    proc_names = ["A", "B", "C", "D", "E"]
+    procs = []
+    thrust_signal = {}
+
+    # Create processors, attaching the output queue of each to the next and loading the
+    # program from the appropriate source
+    for idx in range(num_procs):
+        procs.append(AsyncIntCodeProcessor(name=proc_names[idx]))
+
+    for idx in range(num_procs):
+
+        procs[(idx+1) % num_procs].attach_input_queue(procs[idx].get_output_queue())
+        if test_program:
+            procs[idx].load_program(test_program)
+        elif program_file:
+            procs[idx].load_file(program_file)
+        else:
+            raise RuntimeError("No program input source specified")
+
+    async def search():
+
+        # Loop over all permutations of phase inputs sequences, running the processors
+        # concurrently in the event loop until all have halted
+        for phase_sequence in itertools.permutations([5,6,7,8,9]):
+
+            for (idx, phase) in enumerate(phase_sequence):
+                procs[idx].reset_memory()
+                procs[idx].load_inputs([phase, 0] if idx == 0 else [phase])
+
+            await asyncio.gather(*[proc.run() for proc in procs])
+
+            thrust = procs[-1].get_output_queue().get_nowait()
+            thrust_signal[thrust] = phase_sequence
+
+    asyncio.run(search())
+
+    max_thrust_signal = max(thrust_signal.keys())
+    max_phase_sequence = thrust_signal[max_thrust_signal]
+    
+    logging.debug("Found max thrust signal {} for phase sequence {}".format(
+        max_thrust_signal, ','.join([str(phase) for phase in max_phase_sequence])
+    ))
+    return (max_thrust_signal, max_phase_sequence)
+
 def test_part2():
 
     test_phase_sequences = [
@@ -161,7 +258,20 @@ def test_part2():
     for test_phase_sequence, test_max_thrust, test_program in zip(
         test_phase_sequences, test_max_thrusts, test_programs
     ):
-        (max_thrust, max_phase_sequence) = find_max_thrust_feedback(test_program=test_program)
+        for is_async in (False, True):
+            (max_thrust, max_phase_sequence) = find_max_thrust_feedback(
+                test_program=test_program, is_async=is_async
+            )
+            assert max_thrust == test_max_thrust
+            assert max_phase_sequence == test_phase_sequence
+
+        (max_thrust, max_phase_sequence) = find_max_thrust_feedback(
+            test_program=test_program, is_async=True, channel_type=RingBufferChannel
+        )
+        assert max_thrust == test_max_thrust
+        assert max_phase_sequence == test_phase_sequence
+
+        (max_thrust, max_phase_sequence) = find_max_thrust_asyncio(test_program=test_program)
         assert max_thrust == test_max_thrust
         assert max_phase_sequence == test_phase_sequence
 
@@ -175,6 +285,49 @@ def part2():
     ))
 
 
+def benchmark_feedback(program_file='input_7.txt', iterations=5):
+
+    # Compare the cooperative scheduler and asyncio processors against one thread per
+    # processor for the feedback loop
+    searches = [
+        ('cooperative scheduler', lambda: find_max_thrust_feedback(program_file=program_file)),
+        ('threaded processors',
+            lambda: find_max_thrust_feedback(program_file=program_file, is_async=True)),
+        ('asyncio processors', lambda: find_max_thrust_asyncio(program_file=program_file)),
+    ]
+    for (description, search) in searches:
+        start = time.time()
+        for _ in range(iterations):
+            search()
+        elapsed = (time.time() - start) / iterations
+        logging.info("Feedback loop with {}: {:.3f}s per search".format(description, elapsed))
+
+def benchmark_channels(program_file='input_7.txt', iterations=5):
+
+    # Compare the throughput of the threaded feedback loop passing values through queues and
+    # through ring buffer channels. The number of values passed in a search is counted from a
+    # search with ring buffer channels, whose total puts are their tail indices
+    channels = []
+
+    class CountingChannel(RingBufferChannel):
+        def __init__(self):
+            super().__init__()
+            channels.append(self)
+
+    find_max_thrust_feedback(program_file=program_file, is_async=True, channel_type=CountingChannel)
+    num_values = sum(channel.tail for channel in channels)
+
+    for channel_type in (queue.Queue, RingBufferChannel):
+        start = time.time()
+        for _ in range(iterations):
+            find_max_thrust_feedback(
+                program_file=program_file, is_async=True, channel_type=channel_type
+            )
+        elapsed = (time.time() - start) / iterations
+        logging.info("Feedback loop through {}: {:.0f} values/s".format(
+            channel_type.__name__, num_values / elapsed
+        ))
+
 def main():
 
     log_level = logging.INFO
@@ -188,6 +341,12 @@ def main():
         level=log_level, format='%(levelname)-8s: %(message)s', datefmt='%H:%M:%S'
     )
 
+    # The benchmarks are only run when requested, instead of the puzzle parts
+    if '--benchmark' in sys.argv[1:]:
+        benchmark_feedback()
+        benchmark_channels()
+        return
+
     test_part1()
     part1()
 
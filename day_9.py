@@ -69,7 +69,7 @@ def main():
         level=log_level, format='%(levelname)-8s: %(message)s', datefmt='%H:%M:%S'
     )
 
-    proc = IntCodeProcessor(name='day9')
+    proc = IntCodeProcessor(name='day9', engine=IntCodeProcessor.Engine.JIT)
 
     test_part1(proc)
 
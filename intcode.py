@@ -1,11 +1,361 @@
 # Advent of code 2019 IntCode processor
 
+import asyncio
+import bisect
+import collections
+import concurrent.futures
 import enum
+import functools
+import gzip
+import hashlib
+import json
 import logging
+import mmap
+import multiprocessing
 import operator
+import os
 import queue
+import struct
 import sys
+import tempfile
 import threading
+import time
+
+import numpy as np
+
+class LoggingTraceSink(object):
+
+    def write(self, line):
+        logging.debug(line)
+
+class RingBufferTraceSink(object):
+
+    def __init__(self, capacity=10000):
+        self.lines = collections.deque(maxlen=capacity)
+
+    def write(self, line):
+        self.lines.append(line)
+
+    def get_lines(self):
+        return list(self.lines)
+
+class FileTraceSink(object):
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'w')
+
+    def write(self, line):
+        self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+class CallbackTraceSink(object):
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, line):
+        self.callback(line)
+
+class Profiler(object):
+
+    # Collects execution statistics from the processors it is attached to, which run the
+    # profiling interpreter while it is attached. Basic blocks are identified dynamically,
+    # starting at the first instruction executed after a jump, halt or input
+    def __init__(self):
+
+        self.num_runs = 0
+        self.num_instructions = 0
+        self.num_outputs = 0
+        self.run_time = 0.0
+        self.input_wait_time = 0.0
+        self.memory_high_water = 0
+
+        self.opcode_counts = collections.Counter()
+        self.address_counts = collections.Counter()
+        self.block_counts = collections.Counter()
+        self.stack_counts = collections.Counter()
+
+    def update_memory(self, memory_size):
+
+        self.memory_high_water = max(self.memory_high_water, memory_size)
+
+    def get_report(self):
+
+        return {
+            'runs': self.num_runs,
+            'instructions': self.num_instructions,
+            'outputs': self.num_outputs,
+            'run_time': self.run_time,
+            'input_wait_time': self.input_wait_time,
+            'memory_high_water': self.memory_high_water,
+            'opcodes': {
+                IntCodeProcessor.Opcode(opcode).name: count
+                for (opcode, count) in self.opcode_counts.most_common()
+            },
+            'addresses': {
+                str(addr): count for (addr, count) in self.address_counts.most_common()
+            },
+            'blocks': {
+                str(addr): count for (addr, count) in self.block_counts.most_common()
+            },
+        }
+
+    def to_json(self):
+
+        return json.dumps(self.get_report(), indent=2)
+
+    def write_json(self, file_name):
+
+        with open(file_name, 'w') as f:
+            f.write(self.to_json() + '\n')
+
+    def get_folded_lines(self):
+
+        # Format the instruction counts as folded stacks of processor, block and opcode, as
+        # consumed by flamegraph tools
+        return [
+            "{};block_{:04x};{} {}".format(
+                name, block, IntCodeProcessor.Opcode(opcode).name, count
+            )
+            for ((name, block, opcode), count) in sorted(self.stack_counts.items())
+        ]
+
+    def write_folded(self, file_name):
+
+        with open(file_name, 'w') as f:
+            for line in self.get_folded_lines():
+                f.write(line + '\n')
+
+class RingBufferChannel(object):
+
+    # Single-producer, single-consumer channel over a fixed-size ring buffer, supporting the
+    # subset of the queue.Queue interface used by the processors. Values are passed without
+    # locking, relying on the interpreter to make each index update atomic, and an event is
+    # only waited on, or set, when the consumer finds the channel empty or the producer finds
+    # it full. This only saves locking when values are buffered. Where the consumer is usually
+    # waiting, as in the day 7 feedback loop, each value costs a wake-up as with queue.Queue,
+    # and the throughput is the same
+    def __init__(self, capacity=1024):
+
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+
+        self.not_empty = threading.Event()
+        self.not_full = threading.Event()
+        self.consumer_waiting = False
+        self.producer_waiting = False
+
+    def put(self, value, block=True, timeout=None):
+
+        if self.tail - self.head >= self.capacity:
+            self._wait(self.not_full, 'producer_waiting', self._is_full, block, timeout, queue.Full)
+
+        self.slots[self.tail % self.capacity] = value
+        self.tail += 1
+        if self.consumer_waiting:
+            self.not_empty.set()
+
+    def get(self, block=True, timeout=None):
+
+        if self.head == self.tail:
+            self._wait(self.not_empty, 'consumer_waiting', self.empty, block, timeout, queue.Empty)
+
+        idx = self.head % self.capacity
+        value = self.slots[idx]
+        self.slots[idx] = None
+        self.head += 1
+        if self.producer_waiting:
+            self.not_full.set()
+
+        return value
+
+    def put_nowait(self, value):
+
+        self.put(value, block=False)
+
+    def get_nowait(self):
+
+        return self.get(block=False)
+
+    def task_done(self):
+
+        pass
+
+    def empty(self):
+
+        return self.head == self.tail
+
+    def qsize(self):
+
+        return self.tail - self.head
+
+    def get_pending(self):
+
+        return [self.slots[idx % self.capacity] for idx in range(self.head, self.tail)]
+
+    def _is_full(self):
+
+        return self.tail - self.head >= self.capacity
+
+    def _wait(self, event, waiting_flag, is_blocked, block, timeout, exception):
+
+        # Flag that this side is waiting before checking the condition again, so that the other
+        # side either sees the flag and sets the event, or has already changed the condition
+        if not block:
+            raise exception
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        setattr(self, waiting_flag, True)
+        try:
+            while True:
+                event.clear()
+                if not is_blocked():
+                    return
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise exception
+                event.wait(remaining)
+        finally:
+            setattr(self, waiting_flag, False)
+
+ProcessorSnapshot = collections.namedtuple(
+    'ProcessorSnapshot',
+    [
+        'memory', 'pages', 'instruction_ptr', 'relative_base', 'status', 'inputs', 'outputs',
+        'instruction_count',
+    ]
+)
+
+class InputRequired(Exception):
+    pass
+
+# Binary program images hold the program as an array of little-endian 64-bit integers, following
+# a header of the magic bytes, the program length and the SHA-256 hash of the array
+ProgramImageMagic = b'INTCODE\x01'
+ProgramImageHeader = struct.Struct('<8sQ32s')
+
+def write_program_image(program, file_name):
+
+    data = np.array(program, dtype='<i8').tobytes()
+    with open(file_name, 'wb') as f:
+        f.write(ProgramImageHeader.pack(
+            ProgramImageMagic, len(program), hashlib.sha256(data).digest()
+        ))
+        f.write(data)
+
+def read_program_image(file_name, verify=True):
+
+    # Map the image file into memory, returning a read-only array of the program backed by
+    # the mapped pages, which are shared between processes loading the same image
+    with open(file_name, 'rb') as f:
+        image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, program_len, digest) = ProgramImageHeader.unpack_from(image)
+    if magic != ProgramImageMagic:
+        raise RuntimeError("File {} is not a program image".format(file_name))
+    if len(image) != ProgramImageHeader.size + program_len * 8:
+        raise RuntimeError("Program image {} has incorrect length {}".format(
+            file_name, len(image)
+        ))
+
+    program = np.frombuffer(
+        image, dtype='<i8', count=program_len, offset=ProgramImageHeader.size
+    )
+    if verify and hashlib.sha256(program).digest() != digest:
+        raise RuntimeError("Program image {} failed hash check".format(file_name))
+
+    return program
+
+def convert_program_file(file_name, image_file_name):
+
+    write_program_image(get_program(file_name), image_file_name)
+
+# Programs loaded from files are parsed once per version of each file and shared between all
+# processors running them, the least recently used being evicted when the cache is full
+ProgramCacheSize = 32
+
+@functools.lru_cache(maxsize=ProgramCacheSize)
+def _parse_program_file(file_name, mtime_ns):
+
+    # Parse the program from a binary image if the file starts with the image magic bytes,
+    # otherwise as comma-separated text
+    with open(file_name, 'rb') as f:
+        is_image = f.read(len(ProgramImageMagic)) == ProgramImageMagic
+
+    if is_image:
+        return tuple(read_program_image(file_name).tolist())
+
+    with open(file_name, 'r') as f:
+        lines = f.readlines()
+
+    program = []
+    for line in lines:
+        program.extend([int(val) for val in line.strip().split(',')])
+
+    return tuple(program)
+
+def get_program(file_name):
+
+    file_name = os.path.abspath(file_name)
+    return _parse_program_file(file_name, os.stat(file_name).st_mtime_ns)
+
+def get_program_hash(program):
+
+    return hashlib.sha256(np.array(program, dtype=np.int64).tobytes()).digest()
+
+# Outputs of programs run as pure functions of their inputs and memory patches are memoized,
+# keyed by the program hash, patches and inputs, the least recently used being evicted when
+# the cache is full
+FunctionCacheSize = 65536
+
+class FunctionCache(object):
+
+    def __init__(self, max_size=FunctionCacheSize):
+
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+
+        with self.lock:
+            outputs = self.entries.get(key)
+            if outputs is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return outputs
+
+    def put(self, key, outputs):
+
+        with self.lock:
+            self.entries[key] = outputs
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+            (self.hits, self.misses) = (0, 0)
+
+    def get_report(self):
+
+        return "{} entries, {} hits, {} misses".format(len(self.entries), self.hits, self.misses)
+
+function_cache = FunctionCache()
+
+def get_processor(file_name, **kwargs):
+
+    return IntCodeProcessor(get_program(file_name), **kwargs)
 
 class IntCodeProcessor(object):
 
@@ -26,6 +376,48 @@ class IntCodeProcessor(object):
         IMMEDIATE = 1
         RELATIVE = 2
 
+    # Synchronous processors needing input are suspended, whereas asynchronous processors
+    # block waiting for input to arrive in their input queue
+    class Status(enum.IntEnum):
+        READY = 0
+        RUNNING = 1
+        NEEDS_INPUT = 2
+        BUDGET_EXHAUSTED = 3
+        HALTED = 4
+        WAITING_FOR_INPUT = 5
+
+    class Engine(enum.Enum):
+        INTERPRETER = 'interpreter'
+        THREADED = 'threaded'
+        JIT = 'jit'
+
+    # Feature levels, each adding opcodes and parameter modes to those of the level below.
+    # Basic programs only add and multiply, io programs also read input, write output, compare
+    # and jump, and relative programs also use the relative base
+    class Feature(enum.IntEnum):
+        BASIC = 0
+        IO = 1
+        RELATIVE = 2
+
+    OpcodeFeatures = {
+        Opcode.ADD:        Feature.BASIC,
+        Opcode.MULTIPLY:   Feature.BASIC,
+        Opcode.INPUT:      Feature.IO,
+        Opcode.OUTPUT:     Feature.IO,
+        Opcode.JUMP_TRUE:  Feature.IO,
+        Opcode.JUMP_FALSE: Feature.IO,
+        Opcode.LESS_THAN:  Feature.IO,
+        Opcode.EQUALS:     Feature.IO,
+        Opcode.ADJ_REL:    Feature.RELATIVE,
+        Opcode.HALT:       Feature.BASIC,
+    }
+
+    ParamModeFeatures = {
+        ParamMode.POSITION:  Feature.BASIC,
+        ParamMode.IMMEDIATE: Feature.IO,
+        ParamMode.RELATIVE:  Feature.RELATIVE,
+    }
+
     OpSymbols = {
         'add': '+',
         'mul': '*',
@@ -33,27 +425,108 @@ class IntCodeProcessor(object):
         'lt':  '<',
     }
 
-    def __init__(self, program=[], name="IntCode", is_async=False):
+    TraceMnemonics = {
+        Opcode.ADD:       'ADD',
+        Opcode.MULTIPLY:  'MUL',
+        Opcode.LESS_THAN: 'LT',
+        Opcode.EQUALS:    'EQ',
+    }
+
+    # Memory up to this margin beyond the end of the program is held in a dense list, extended
+    # as required. Memory above that is held in sparse pages allocated on first write
+    DenseMemoryMargin = 4096
+    MemoryPageSize = 1024
+
+    BatchOperators = {
+        Opcode.ADD:       np.add,
+        Opcode.MULTIPLY:  np.multiply,
+        Opcode.LESS_THAN: lambda value_1, value_2: (value_1 < value_2).astype(np.int64),
+        Opcode.EQUALS:    lambda value_1, value_2: (value_1 == value_2).astype(np.int64),
+    }
+
+    CompiledOperators = {
+        Opcode.ADD:       "{} + {}",
+        Opcode.MULTIPLY:  "{} * {}",
+        Opcode.LESS_THAN: "1 if {} < {} else 0",
+        Opcode.EQUALS:    "1 if {} == {} else 0",
+    }
+
+    JumpOpcodes = (Opcode.JUMP_TRUE, Opcode.JUMP_FALSE)
+
+    # Basic blocks end at a jump or halt, and also at an input, which may suspend execution.
+    # Blocks are compiled by the JIT engine once they have been entered the threshold number of
+    # times
+    BlockTerminators = JumpOpcodes + (Opcode.INPUT, Opcode.HALT)
+    HotBlockThreshold = 10
+    MaxBlockInstructions = 64
 
-        self.program = program
+    def __init__(self, program=[], name="IntCode", is_async=False, engine=Engine.INTERPRETER,
+        channel_type=queue.Queue, features=Feature.RELATIVE, output_capacity=0):
+
+        self.program = tuple(program)
+        self.program_hash = None
+        self.prefix = None
         self.name = name
         self.is_async = is_async
+        self.engine = engine
+        self.channel_type = channel_type
+        self.features = features
+        self.output_capacity = output_capacity
 
         self.memory = []
-        self.inputs = []
+        self.pages = {}
+        self.shared_pages = set()
+        self.inputs = collections.deque()
         self.outputs = []
+        self.instruction_ptr = 0
+        self.status = self.Status.READY
         self.input_queue = None
-        self.output_queue = queue.Queue()
         self.input_method = None
         self.output_method = None
+        self.frame_method = None
+        self.frame_size = None
+        self.frame_delimiter = None
 
         self.run_thread = None
 
+        # Asynchronous outputs are passed through a queue, which if it has a capacity blocks
+        # the processor when full until outputs are consumed. Consumers waiting for output
+        # through get_output are notified of each output, and when the processor halts. The
+        # input event is set while the processor is blocked waiting for input
+        if output_capacity:
+            self.output_queue = channel_type(output_capacity)
+        else:
+            self.output_queue = channel_type()
+        self.output_condition = threading.Condition()
+        self.output_waiting = False
+        self.halted = threading.Event()
+        self.input_wait = threading.Event()
+
+        self.trace_sink = None
+        self.profiler = None
+        self.suspend_time = None
+        self.recorder = None
         self.diagnostic_debug = False
 
         self.relative_base = 0
-
-        self.instructions = {
+        self.instruction_count = 0
+
+        self.decode_cache = {}
+        self.compiled_code = {}
+        self.code_spans = {}
+        self.code_addrs = set()
+        self.pristine_code = set()
+        self.modified_code = set()
+
+        self.block_counts = {}
+        self.compiled_blocks = {}
+        self.block_cache = {}
+        self.block_addrs = collections.defaultdict(set)
+        self.pristine_blocks = set()
+
+        # The dispatch table only includes the opcodes of the selected feature level, so that
+        # programs using any other opcodes or parameter modes are rejected as invalid
+        instructions = {
             self.Opcode.ADD:        (self._add, 4),
             self.Opcode.MULTIPLY:   (self._multiply, 4),
             self.Opcode.INPUT:      (self._input, 2),
@@ -65,22 +538,54 @@ class IntCodeProcessor(object):
             self.Opcode.ADJ_REL:    (self._adjust_relative, 2),
             self.Opcode.HALT:       (self._halt, 1),
         }
+        self.instructions = {
+            opcode: instruction for (opcode, instruction) in instructions.items()
+            if self.OpcodeFeatures[opcode] <= features
+        }
+        self.param_modes = [
+            mode for (mode, feature) in self.ParamModeFeatures.items() if feature <= features
+        ]
         self.max_instruction_len = max([ins[1] for ins in self.instructions.values()])
+
+        # Superinstructions fusing common pairs of instructions, i.e. a comparison followed by a
+        # jump conditional on its result, and an addition followed by a relative base adjustment
+        fused_instructions = {
+            (self.Opcode.LESS_THAN, self.Opcode.JUMP_TRUE):
+                functools.partial(self._compare_jump, operation=operator.lt, condition=True),
+            (self.Opcode.LESS_THAN, self.Opcode.JUMP_FALSE):
+                functools.partial(self._compare_jump, operation=operator.lt, condition=False),
+            (self.Opcode.EQUALS, self.Opcode.JUMP_TRUE):
+                functools.partial(self._compare_jump, operation=operator.eq, condition=True),
+            (self.Opcode.EQUALS, self.Opcode.JUMP_FALSE):
+                functools.partial(self._compare_jump, operation=operator.eq, condition=False),
+            (self.Opcode.ADD, self.Opcode.ADJ_REL):
+                self._add_adjust_relative,
+        }
+        self.fused_instructions = {
+            (first, second): instruction
+            for ((first, second), instruction) in fused_instructions.items()
+            if first in self.instructions and second in self.instructions
+        }
+        self.max_code_len = max([
+            self.instructions[first][1] + self.instructions[second][1]
+            for (first, second) in self.fused_instructions
+        ], default=self.max_instruction_len)
         self.reset_memory()
 
     def load_file(self, file_name):
 
-        with open(file_name, 'r') as f:
-            lines = f.readlines()
-
-        self.program = []
-        for line in lines:
-            self.program.extend([int(val) for val in line.strip().split(',')])
+        self.program = get_program(file_name)
+        self.program_hash = None
+        self.prefix = None
+        self._clear_code_cache()
         self.reset_memory()
 
     def load_program(self, program):
 
-        self.program = program
+        self.program = tuple(program)
+        self.program_hash = None
+        self.prefix = None
+        self._clear_code_cache()
         self.reset_memory()
 
     def load_inputs(self, inputs):
@@ -89,25 +594,135 @@ class IntCodeProcessor(object):
         if self.is_async:
             [self.input_queue.put(val) for val in inputs]
         else:
-            self.inputs = inputs
+            self.inputs.clear()
+            self.inputs.extend(inputs)
 
     def get_outputs(self):
         return self.outputs
 
     def reset_memory(self):
 
-        self.memory = self.program.copy()
+        # Restore memory in place, since compiled instructions hold a reference to it
+        self.memory[:] = self.program
         self.memory_len = len(self.memory)
+        self.dense_limit = self.memory_len + self.DenseMemoryMargin
+
+        self.pages.clear()
+        self.shared_pages.clear()
 
+        self.instruction_ptr = 0
+        self.instruction_count = 0
         self.relative_base = 0
+        self.status = self.Status.READY
+        self.outputs = []
+
+        # Discard any cached code decoded from modified memory, retaining that decoded from
+        # the program itself, which remains valid for the restored memory
+        for ptr in [ptr for ptr in self.code_spans if ptr not in self.pristine_code]:
+            self._discard_code(ptr)
+        for ptr in [ptr for ptr in self.compiled_blocks if ptr not in self.pristine_blocks]:
+            self._discard_block(ptr)
+
+    def snapshot(self):
+
+        # Pages are shared with the snapshot, and copied before they are next written
+        self.shared_pages = set(self.pages)
+
+        return ProcessorSnapshot(
+            tuple(self.memory), dict(self.pages),
+            self.instruction_ptr, self.relative_base, self.status,
+            tuple(self._get_pending(self.input_queue, self.inputs)),
+            tuple(self._get_pending(self.output_queue, self.outputs)),
+            self.instruction_count,
+        )
+
+    def restore(self, snapshot):
+
+        self.memory[:] = snapshot.memory
+        self.pages = dict(snapshot.pages)
+        self.shared_pages = set(self.pages)
+        self.instruction_ptr = snapshot.instruction_ptr
+        self.relative_base = snapshot.relative_base
+        self.status = snapshot.status
+        self.instruction_count = snapshot.instruction_count
+
+        if self.is_async:
+            if self.input_queue is None:
+                self.input_queue = self.channel_type()
+            self._set_pending(self.input_queue, snapshot.inputs)
+            self._set_pending(self.output_queue, snapshot.outputs)
+        else:
+            self.inputs.clear()
+            self.inputs.extend(snapshot.inputs)
+            self.outputs = list(snapshot.outputs)
+
+        # Discard any cached code which does not match the restored memory
+        for (ptr, instruction_len) in list(self.code_spans.items()):
+            if ptr not in self.pristine_code or \
+                tuple(self.memory[ptr:ptr+instruction_len]) != \
+                    self.program[ptr:ptr+instruction_len]:
+                self._discard_code(ptr)
+        for (ptr, block) in list(self.compiled_blocks.items()):
+            if ptr not in self.pristine_blocks or \
+                tuple(self.memory[ptr:ptr+block[1]]) != self.program[ptr:ptr+block[1]]:
+                self._discard_block(ptr)
+
+    def fork(self):
+
+        proc = self._create_fork()
+        proc.input_method = self.input_method
+        proc.output_method = self.output_method
+        proc.frame_method = self.frame_method
+        proc.frame_size = self.frame_size
+        proc.frame_delimiter = self.frame_delimiter
+        proc.trace_sink = self.trace_sink
+        proc.profiler = self.profiler
+        proc.restore(self.snapshot())
+
+        # A recorder records a single session, so is not attached to the fork
+
+        return proc
+
+    def _create_fork(self):
+
+        return IntCodeProcessor(
+            self.program, self.name, self.is_async, self.engine, self.channel_type, self.features,
+            self.output_capacity
+        )
+
+    def _get_pending(self, io_queue, io_list):
+
+        if not self.is_async:
+            return list(io_list)
+        if io_queue is None:
+            return []
+        if isinstance(io_queue, RingBufferChannel):
+            return io_queue.get_pending()
+        with io_queue.mutex:
+            return list(io_queue.queue)
+
+    def _set_pending(self, io_queue, values):
+
+        while True:
+            try:
+                io_queue.get_nowait()
+                io_queue.task_done()
+            except queue.Empty:
+                break
+        for value in values:
+            io_queue.put(value)
+
+    def set_memory(self, addr, value):
+
+        self._write_memory(addr, value)
 
     def set_noun(self, noun):
 
-        self.memory[1] = noun
+        self._write_memory(1, noun)
 
     def set_verb(self, verb):
 
-        self.memory[2] = verb
+        self._write_memory(2, verb)
 
     def attach_input_queue(self, input_queue):
 
@@ -125,10 +740,46 @@ class IntCodeProcessor(object):
 
         self.output_method = output_method
 
-    def run(self):
+    def attach_frame_method(self, frame_method, frame_size=None, delimiter=None):
+
+        # Deliver outputs to the frame method in batches of complete frames, rather than
+        # individually. Each frame is a tuple of either the specified number of values, or the
+        # values preceding the delimiter. Batches are delivered before each input is read and
+        # whenever a run stops, any incomplete frame remaining in the outputs
+        if (frame_size is None) == (delimiter is None):
+            raise RuntimeError("Output frames require either a frame size or a delimiter")
+        if self.is_async:
+            raise RuntimeError("Asynchronous processor outputs cannot be framed")
+
+        self.frame_method = frame_method
+        self.frame_size = frame_size
+        self.frame_delimiter = delimiter
+        self.output_method = None
+
+    def attach_trace_sink(self, trace_sink):
+
+        self.trace_sink = trace_sink
+
+    def attach_profiler(self, profiler):
+
+        self.profiler = profiler
+
+    def attach_recorder(self, recorder):
+
+        self.recorder = recorder
+
+    def run(self, max_instructions=None):
+
+        # Run the program, resuming from wherever a previous run was suspended. If an
+        # instruction budget is specified, run synchronously for at most that many instructions
+        # and return the resulting status
+        if max_instructions is not None:
+            self._run(max_instructions)
+            return self.status
 
         if self.is_async:
-            self.run_thread = threading.Thread(target=self._run)
+            self.halted.clear()
+            self.run_thread = threading.Thread(target=self._run_thread)
             self.run_thread.start()
             logging.debug("Processor {} starting in thread".format(self.name))
             return self.run_thread
@@ -136,54 +787,999 @@ class IntCodeProcessor(object):
             output = self._run()
             return output
 
-    def _run(self):
+    def _run_thread(self):
+
+        # Wake any consumers waiting for output when the thread stops, even if the processor
+        # failed rather than halted
+        try:
+            self._run()
+        finally:
+            self._notify_output()
+
+    def get_output(self, timeout=None):
+
+        # Get the next output of an asynchronous processor, waiting until one is available,
+        # returning None if the processor halts without another output. Raises queue.Empty if
+        # the timeout expires first
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.output_condition:
+            self.output_waiting = True
+            try:
+                while True:
+                    try:
+                        return self.output_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    if self.halted.is_set():
+                        return None
+                    if self.run_thread is not None and not self.run_thread.is_alive():
+                        raise RuntimeError("Processor {} stopped without halting".format(
+                            self.name
+                        ))
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self.output_condition.wait(remaining)
+            finally:
+                self.output_waiting = False
+
+    def _notify_output(self):
+
+        with self.output_condition:
+            self.output_condition.notify_all()
+
+    def _run(self, max_instructions=None):
         
         logging.debug('Running program of length {}'.format(self.memory_len))
-        
-        self.instruction_ptr = 0
-        self.outputs = []
+
+        # Resume from the current instruction pointer, unless the previous run halted, in
+        # which case the program is run again from the start
+        if self.status == self.Status.HALTED:
+            self.instruction_ptr = 0
+            self.instruction_count = 0
+            self.outputs = []
+        self.status = self.Status.RUNNING
         self.running = True
+        self.halted.clear()
+
+        # Execute the program with the selected engine, unless the session is being recorded,
+        # traced or profiled, in which case the recording, traced or profiling interpreter is
+        # used instead, in that order of precedence, since a recording must include every
+        # input. If the program requires input when none is available, execution
+        # is suspended at the input instruction, to be resumed by the next run. Execution is
+        # similarly suspended if the instruction budget is exhausted
+        if max_instructions is None:
+            max_instructions = sys.maxsize
+
+        trace_sink = self._resolve_trace_sink()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.num_runs += 1
+            start_time = time.perf_counter()
+            if self.suspend_time is not None:
+                profiler.input_wait_time += start_time - self.suspend_time
+                self.suspend_time = None
+
+        try:
+            if self.recorder is not None:
+                num_instructions = self._execute_recorded(self.recorder, max_instructions)
+            elif trace_sink is not None:
+                num_instructions = self._execute_traced(trace_sink, max_instructions)
+            elif profiler is not None:
+                num_instructions = self._execute_profiled(profiler, max_instructions)
+            elif self.engine == self.Engine.THREADED:
+                num_instructions = self._execute_threaded(max_instructions)
+            elif self.engine == self.Engine.JIT:
+                num_instructions = self._execute_jit(max_instructions)
+            else:
+                num_instructions = self._execute_interpreted(max_instructions)
+        except InputRequired:
+            self.status = self.Status.NEEDS_INPUT
+            logging.debug("Processor {} suspended waiting for input at {}".format(
+                self.name, self.instruction_ptr
+            ))
+            if self.frame_method is not None:
+                self._deliver_frames()
+            if profiler is not None:
+                self._update_profile(profiler, start_time)
+                self.suspend_time = time.perf_counter()
+            return self.memory[0]
+
+        if profiler is not None:
+            self._update_profile(profiler, start_time)
+
+        if self.frame_method is not None:
+            self._deliver_frames()
+
+        if self.running and (self.instruction_ptr < self.memory_len):
+            self.status = self.Status.BUDGET_EXHAUSTED
+            return self.memory[0]
+
+        self.status = self.Status.HALTED
+        self.halted.set()
+        if self.output_waiting:
+            self._notify_output()
+
+        # Run complete, set the output parameter to the conents of the first memory position
+        output = self.memory[0]
+        logging.debug("Run completed after {} instructions with output {}".format(
+            num_instructions, output
+        ))
+        return output
+
+    def step_until(self, predicate, max_instructions=None):
+
+        # Execute single instructions until the predicate, called with the processor, is true,
+        # returning the resulting status. Execution also stops if the program halts or needs
+        # input, or after the maximum number of instructions if specified
         num_instructions = 0
+        while max_instructions is None or num_instructions < max_instructions:
+            self._run(1)
+            num_instructions += 1
+            if self.status != self.Status.BUDGET_EXHAUSTED or predicate(self):
+                break
 
-        # Loop over the instructions in memory while HALT has not been encountered and the
-        # instruction pointer is within bounds
+        return self.status
 
-        while self.running and (self.instruction_ptr < self.memory_len):
+    def coroutine(self):
 
-            # Get the next opcode and parameter modes from memory
-            (opcode, param_modes) = self._parse_instruction(self.memory[self.instruction_ptr])
+        # Generator running the processor until it halts, yielding whenever it is suspended
+        # waiting for input
+        while True:
+            self.run()
+            if self.status == self.Status.HALTED:
+                return
+            yield self.status
 
-            # Attempt to resolve the instruction function and length from the opcode dict
-            try:
-                (instruction, instruction_len) = self.instructions[opcode]
-            except KeyError:
-                raise RuntimeError(
-                    "Invalid opcode {} at instruction pointer {}".format(
-                    opcode, self.instruction_ptr
-                ))
+    def run_function(self, inputs, patches={}, cache=None):
+
+        # Run the program as a pure function of its inputs and any memory patches, specified as
+        # a dict mapping an address to a value, returning the tuple of outputs. The program is
+        # run from reset memory, unless the outputs for the same program, patches and inputs are
+        # already in the cache, in which case the processor is left untouched
+        if self.is_async:
+            raise RuntimeError("Asynchronous processors cannot be run as functions")
+        if cache is None:
+            cache = function_cache
+        if self.program_hash is None:
+            self.program_hash = get_program_hash(self.program)
+
+        key = (self.program_hash, tuple(sorted(patches.items())), tuple(inputs))
+        outputs = cache.get(key)
+        if outputs is not None:
+            return outputs
+
+        # Start from the state after the input-independent prefix if there is one, writing the
+        # inputs the prefix reads to the addresses it read them to
+        if self.prefix is not None and not patches and len(inputs) >= len(self.prefix[-1]):
+            (changes, instruction_ptr, relative_base, instruction_count, outputs,
+                input_addrs) = self.prefix
+            self.reset_memory()
+            for (addr, value) in changes:
+                self._write_memory(addr, value)
+            for (addr, value) in zip(input_addrs, inputs):
+                self._write_memory(addr, value)
+            self.instruction_ptr = instruction_ptr
+            self.relative_base = relative_base
+            self.instruction_count = instruction_count
+            self.outputs = list(outputs)
+            self.load_inputs(inputs[len(input_addrs):])
+        else:
+            self.reset_memory()
+            for (addr, value) in patches.items():
+                self._write_memory(addr, value)
+            self.load_inputs(inputs)
+        self.run()
+        if self.status != self.Status.HALTED:
+            raise RuntimeError("Function {} did not halt on inputs {}".format(self.name, inputs))
+
+        outputs = tuple(self.outputs)
+        cache.put(key, outputs)
+
+        return outputs
+
+    def attach_prefix(self, num_instructions, input_addrs):
+
+        # Run the input-independent prefix of the program, i.e. the instructions executed the
+        # same whatever the inputs, as found by analysis, once with placeholder inputs, so that
+        # function runs can start from the state after it. The addresses the prefix reads
+        # inputs to must not be read by the prefix itself. The state is held as the changes to
+        # the program memory, which are cheaper to apply to reset memory than a full restore
+        self.reset_memory()
+        self.load_inputs([0] * len(input_addrs))
+        self._run(num_instructions)
+        if self.instruction_count != num_instructions or self.status == self.Status.HALTED:
+            raise RuntimeError("Program prefix ended after {} instructions".format(
+                self.instruction_count
+            ))
+
+        changes = [
+            (addr, value) for (addr, value) in enumerate(self.memory)
+            if value != (self.program[addr] if addr < len(self.program) else 0)
+        ]
+        for (page_idx, page) in sorted(self.pages.items()):
+            changes.extend(
+                (page_idx * self.MemoryPageSize + offset, value)
+                for (offset, value) in enumerate(page) if value != 0
+            )
+
+        self.prefix = (
+            tuple(changes), self.instruction_ptr, self.relative_base, self.instruction_count,
+            tuple(self.outputs), tuple(input_addrs)
+        )
+        self.reset_memory()
+
+    def run_batch(self, inputs_matrix, patches={}):
+
+        # Run independent instances of the program, one per row of the inputs matrix, in
+        # lock-step over a matrix of memory with a lane per instance. At each step the active
+        # lanes are grouped by the instruction word at their pointer, so that lanes which have
+        # diverged execute their own instructions. Memory patches can be specified as a dict
+        # mapping an address to a value, or to a value per lane. Memory values are 64-bit.
+        # Returns the list of outputs produced by each lane
+        inputs_matrix = np.array(inputs_matrix, dtype=np.int64, ndmin=2)
+        num_lanes = inputs_matrix.shape[0]
+
+        memory = np.zeros((num_lanes, self.memory_len + self.DenseMemoryMargin), dtype=np.int64)
+        memory[:, :self.memory_len] = self.program
+        for (addr, value) in patches.items():
+            if addr >= memory.shape[1]:
+                memory = np.pad(memory, ((0, 0), (0, addr + 1 - memory.shape[1])))
+            memory[:, addr] = value
+
+        instruction_ptr = np.zeros(num_lanes, dtype=np.int64)
+        relative_base = np.zeros(num_lanes, dtype=np.int64)
+        input_idx = np.zeros(num_lanes, dtype=np.int64)
+        active = np.ones(num_lanes, dtype=bool)
+        outputs = [[] for _ in range(num_lanes)]
+
+        while True:
+
+            active &= (instruction_ptr < self.memory_len)
+            active_lanes = np.flatnonzero(active)
+            if not len(active_lanes):
+                break
+
+            words = memory[active_lanes, instruction_ptr[active_lanes]]
+
+            for word in np.unique(words):
+
+                lanes = active_lanes[words == word]
+                ptr = instruction_ptr[lanes]
+                (opcode, param_modes) = self._parse_instruction(int(word))
+
+                def param(idx):
+                    return memory[lanes, ptr + idx + 1]
+
+                def address(idx):
+                    addr = param(idx)
+                    if param_modes[idx] == self.ParamMode.RELATIVE:
+                        addr = addr + relative_base[lanes]
+                    elif param_modes[idx] != self.ParamMode.POSITION:
+                        raise RuntimeError(
+                            "Illegal parameter mode {} encountered".format(param_modes[idx])
+                        )
+                    if addr.min() < 0:
+                        raise RuntimeError("Attempted to access memory below address 0")
+                    return addr
+
+                def read(idx):
+                    if param_modes[idx] == self.ParamMode.IMMEDIATE:
+                        return param(idx)
+                    # Memory beyond the matrix has not been written, so reads as zero
+                    addr = address(idx)
+                    in_range = addr < memory.shape[1]
+                    if in_range.all():
+                        return memory[lanes, addr]
+                    return np.where(
+                        in_range, memory[lanes, np.minimum(addr, memory.shape[1] - 1)], 0
+                    )
+
+                def write(idx, values):
+                    nonlocal memory
+                    addr = address(idx)
+                    if addr.max() >= memory.shape[1]:
+                        memory = np.pad(memory, ((0, 0), (0, addr.max() + 1 - memory.shape[1])))
+                    memory[lanes, addr] = values
+
+                if opcode not in self.instructions:
+                    raise RuntimeError(
+                        "Invalid opcode {} at instruction pointer {}".format(opcode, ptr.min())
+                    )
+
+                if opcode in self.BatchOperators:
+                    write(2, self.BatchOperators[opcode](read(0), read(1)))
+                    instruction_ptr[lanes] += 4
+
+                elif opcode == self.Opcode.INPUT:
+                    if input_idx[lanes].max() >= inputs_matrix.shape[1]:
+                        raise RuntimeError("Batch lane input exhausted at instruction pointer {}".format(
+                            ptr.max()
+                        ))
+                    write(0, inputs_matrix[lanes, input_idx[lanes]])
+                    input_idx[lanes] += 1
+                    instruction_ptr[lanes] += 2
+
+                elif opcode == self.Opcode.OUTPUT:
+                    for (lane, value) in zip(lanes, read(0)):
+                        outputs[lane].append(int(value))
+                    instruction_ptr[lanes] += 2
+
+                elif opcode in (self.Opcode.JUMP_TRUE, self.Opcode.JUMP_FALSE):
+                    condition = (read(0) != 0) == (opcode == self.Opcode.JUMP_TRUE)
+                    instruction_ptr[lanes] = np.where(condition, read(1), ptr + 3)
+
+                elif opcode == self.Opcode.ADJ_REL:
+                    relative_base[lanes] += read(0)
+                    instruction_ptr[lanes] += 2
+
+                elif opcode == self.Opcode.HALT:
+                    active[lanes] = False
+
+                else:
+                    raise RuntimeError(
+                        "Invalid opcode {} at instruction pointer {}".format(opcode, ptr.min())
+                    )
+
+        return outputs
+
+    def _execute_interpreted(self, max_instructions):
+
+        decode_cache = self.decode_cache
+        num_instructions = 0
+
+        # Loop over the instructions in memory while HALT has not been encountered, the
+        # instruction pointer is within bounds and the instruction budget is not exhausted
+
+        try:
+            while self.running and (self.instruction_ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                # Get the decoded instruction at the pointer from the cache, decoding it on a miss.
+                # This may be a fused pair of instructions, which is decoded separately if it would
+                # exceed the instruction budget
+                try:
+                    (instruction, instruction_len, params, param_modes, count) = \
+                        decode_cache[self.instruction_ptr]
+                except KeyError:
+                    (instruction, instruction_len, params, param_modes, count) = \
+                        self._decode_instruction(self.instruction_ptr)
+
+                if num_instructions + count > max_instructions:
+                    (instruction, instruction_len, params, param_modes, count) = \
+                        self._decode_instruction(self.instruction_ptr, fuse=False)
+
+                # Execute the instruction. A fused pair returns True if only its first instruction
+                # was executed, since it wrote to the second
+                if instruction(*params, param_modes):
+                    count = 1
+
+                # Increment the instruction pointer by the appropriate length
+                self.instruction_ptr += instruction_len
+                num_instructions += count
+        finally:
+            self.instruction_count += num_instructions
+
+        return num_instructions
+
+    def _execute_traced(self, trace_sink, max_instructions):
+
+        num_instructions = 0
+
+        try:
+            while self.running and (self.instruction_ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                ptr = self.instruction_ptr
+                (instruction, instruction_len, params, param_modes) = self._decode_single(ptr)
+                opcode = self.memory[ptr] % 100
+
+                if self.diagnostic_debug:
+                    logging.debug("****: ptr {} mem {} opcode {} params {} param_modes {}".format(
+                        ptr, self.memory[ptr], opcode, params, param_modes
+                    ))
+
+                # Trace the instruction and execute it. Input instructions are traced afterwards
+                # so that the input value can be shown
+                if opcode == self.Opcode.INPUT:
+                    instruction(*params, param_modes)
+                    trace_lines = self._trace_input(ptr, params, param_modes)
+                else:
+                    trace_lines = self._trace_instruction(ptr, opcode, params, param_modes)
+                    for line in trace_lines:
+                        trace_sink.write(line)
+                    trace_lines = []
+                    instruction(*params, param_modes)
+
+                for line in trace_lines:
+                    trace_sink.write(line)
+
+                self.instruction_ptr += instruction_len
+                num_instructions += 1
+        finally:
+            self.instruction_count += num_instructions
 
-            # Extract the instruction parameter list from memory
-            params = self.memory[self.instruction_ptr+1:self.instruction_ptr+instruction_len]
+        return num_instructions
+
+    def _execute_profiled(self, profiler, max_instructions):
+
+        num_instructions = 0
+        block = self.instruction_ptr
+        at_block_start = True
+
+        # Interpret the instructions individually, counting each once it has executed, so
+        # that an input instruction which suspends execution is only counted when resumed
+
+        try:
+            while self.running and (self.instruction_ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                ptr = self.instruction_ptr
+                (instruction, instruction_len, params, param_modes) = self._decode_single(ptr)
+                opcode = self.memory[ptr] % 100
+
+                if opcode == self.Opcode.INPUT:
+                    input_start = time.perf_counter()
+                    try:
+                        instruction(*params, param_modes)
+                    finally:
+                        profiler.input_wait_time += time.perf_counter() - input_start
+                else:
+                    instruction(*params, param_modes)
+                    if opcode == self.Opcode.OUTPUT:
+                        profiler.num_outputs += 1
+
+                if at_block_start:
+                    block = ptr
+                    profiler.block_counts[ptr] += 1
+                at_block_start = opcode in self.BlockTerminators
+
+                profiler.num_instructions += 1
+                profiler.opcode_counts[opcode] += 1
+                profiler.address_counts[ptr] += 1
+                profiler.stack_counts[(self.name, block, opcode)] += 1
+
+                self.instruction_ptr += instruction_len
+                num_instructions += 1
+        finally:
+            self.instruction_count += num_instructions
+
+        return num_instructions
+
+    def _execute_recorded(self, recorder, max_instructions):
+
+        num_instructions = 0
+
+        # Interpret the instructions individually, checkpointing the processor state at the
+        # recorder interval and recording each input read along with the number of
+        # instructions executed before it
+
+        try:
+            while self.running and (self.instruction_ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                instruction_count = self.instruction_count + num_instructions
+                recorder.check_checkpoint(self, instruction_count)
+
+                ptr = self.instruction_ptr
+                (instruction, instruction_len, params, param_modes) = self._decode_single(ptr)
+
+                if self.memory[ptr] % 100 == self.Opcode.INPUT:
+                    input_value = self._read_input()
+                    recorder.record_input(instruction_count, input_value)
+                    input_ptr = self._resolve_output(params[0], [param_modes[0]])
+                    self._write_memory(input_ptr, input_value)
+                else:
+                    instruction(*params, param_modes)
+
+                self.instruction_ptr += instruction_len
+                num_instructions += 1
+        finally:
+            self.instruction_count += num_instructions
+
+        return num_instructions
+
+    def _update_profile(self, profiler, start_time):
+
+        profiler.run_time += time.perf_counter() - start_time
+        profiler.update_memory(len(self.memory) + len(self.pages) * self.MemoryPageSize)
+
+    def _resolve_trace_sink(self):
+
+        # Use the attached trace sink if present, otherwise trace to the debug log if enabled
+        if self.trace_sink is not None:
+            return self.trace_sink
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            return LoggingTraceSink()
+        return None
+
+    def _execute_threaded(self, max_instructions):
+
+        compiled_code = self.compiled_code
+        modified_code = self.modified_code
+        ptr = self.instruction_ptr
+        num_instructions = 0
+
+        # Loop over the compiled instructions, each of which executes and returns the pointer
+        # to the next. Instructions are compiled on first execution, except where the program
+        # has modified them, which are executed by the interpreter instead
+
+        try:
+            while self.running and (ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                compiled = compiled_code.get(ptr)
+                if compiled is None:
+                    if ptr in modified_code:
+                        self.instruction_ptr = ptr
+                        self._step_interpreted()
+                        ptr = self.instruction_ptr
+                        num_instructions += 1
+                        continue
+                    compiled = self._compile_instruction(ptr)
+
+                ptr = compiled()
+                num_instructions += 1
+        finally:
+            self.instruction_ptr = ptr
+            self.instruction_count += num_instructions
+
+        return num_instructions
+
+    def _execute_jit(self, max_instructions):
+
+        compiled_blocks = self.compiled_blocks
+        block_counts = self.block_counts
+        ptr = self.instruction_ptr
+        at_block_start = True
+        num_instructions = 0
+
+        # Loop over the program, executing compiled blocks where available and interpreting
+        # instructions otherwise. Entries to each block are counted while it is interpreted,
+        # and it is compiled once hot. A compiled block returns the pointer to the next
+        # instruction and the number of instructions it executed, exiting early if it writes
+        # to cached code. Blocks which would exceed the remaining instruction budget are
+        # interpreted instead. A new block starts after a terminating or modified instruction
+
+        try:
+            while self.running and (ptr < self.memory_len) and \
+                (num_instructions < max_instructions):
+
+                block = compiled_blocks.get(ptr)
+                if block is None and at_block_start:
+                    block_count = block_counts.get(ptr, 0) + 1
+                    block_counts[ptr] = block_count
+                    if block_count >= self.HotBlockThreshold:
+                        block = self._compile_block(ptr)
+
+                if block is not None and block[2] <= max_instructions - num_instructions:
+                    (ptr, block_instructions) = block[0]()
+                    num_instructions += block_instructions
+                    at_block_start = True
+                    continue
+
+                self.instruction_ptr = ptr
+                at_block_start = (self.memory[ptr] % 100) in self.BlockTerminators or \
+                    ptr in self.modified_code
+                self._step_interpreted()
+                ptr = self.instruction_ptr
+                num_instructions += 1
+        finally:
+            self.instruction_ptr = ptr
+            self.instruction_count += num_instructions
+
+        return num_instructions
+
+    def _step_interpreted(self):
+
+        (instruction, instruction_len, params, param_modes) = \
+            self._decode_single(self.instruction_ptr)
+
+        instruction(*params, param_modes)
+        self.instruction_ptr += instruction_len
+
+    def _decode_single(self, ptr):
+
+        # Get the single decoded instruction at the pointer, where the caller executes or
+        # traces instructions individually
+        decoded = self.decode_cache.get(ptr)
+        if decoded is None or decoded[4] > 1:
+            decoded = self._decode_instruction(ptr, fuse=False)
+
+        return decoded[:4]
+
+    def _decode_instruction(self, ptr, fuse=True):
+
+        # Get the opcode and parameter modes from memory
+        (opcode, param_modes) = self._parse_instruction(self.memory[ptr])
+
+        # Attempt to resolve the instruction function and length from the opcode dict
+        try:
+            (instruction, instruction_len) = self.instructions[opcode]
+        except KeyError:
+            raise RuntimeError(
+                "Invalid opcode {} at instruction pointer {}".format(opcode, ptr)
+            )
+
+        # Extract the instruction parameter list from memory
+        params = self.memory[ptr+1:ptr+instruction_len]
+
+        # Cache the decoded instruction, fused with the following instruction if possible,
+        # along with the number of instructions it executes
+        decoded = None
+        if fuse:
+            decoded = self._fuse_instruction(ptr, opcode, instruction_len, params, param_modes)
+        if decoded is None:
+            decoded = (instruction, instruction_len, params, param_modes, 1)
+        self.decode_cache[ptr] = decoded
+        self._cache_code(ptr, decoded[1])
+
+        return decoded
+
+    def _fuse_instruction(self, ptr, opcode, instruction_len, params, param_modes):
+
+        # Decode the instruction following that at the pointer, returning None if the pair
+        # cannot be fused
+        next_ptr = ptr + instruction_len
+        if next_ptr >= self.memory_len:
+            return None
+        try:
+            (next_opcode, next_modes) = self._parse_instruction(self.memory[next_ptr])
+        except ValueError:
+            return None
+
+        instruction = self.fused_instructions.get((opcode, next_opcode))
+        if instruction is None:
+            return None
+
+        next_len = self.instructions[next_opcode][1]
+        fused_len = instruction_len + next_len
+        if ptr + fused_len > self.memory_len:
+            return None
+        next_params = self.memory[next_ptr+1:next_ptr+next_len]
+
+        # A comparison must be followed by a jump to an immediate target conditional on the
+        # cell it writes
+        output_mode = param_modes[2]
+        if next_opcode in self.JumpOpcodes and (
+            output_mode == self.ParamMode.IMMEDIATE or
+            (next_modes[0], next_params[0]) != (output_mode, params[2]) or
+            next_modes[1] != self.ParamMode.IMMEDIATE
+        ):
+            return None
+
+        # The first instruction must not write to the pair where this is known in advance.
+        # Relative writes are checked when executed
+        if output_mode != self.ParamMode.RELATIVE and ptr <= params[2] < ptr + fused_len:
+            return None
+
+        return (
+            instruction, fused_len, params + next_params,
+            param_modes + next_modes[:next_len-1], 2
+        )
+
+    def _compile_instruction(self, ptr):
+
+        lines = []
+        exit = lambda next_ptr: "return {}".format(next_ptr)
+        (instruction_len, opcode) = self._generate_instruction(ptr, lines, exit)
+        if opcode not in self.JumpOpcodes:
+            lines.append(exit(ptr + instruction_len))
+
+        # Cache the compiled instruction
+        compiled = self._compile_function("instruction_{}".format(ptr), lines)
+        self.compiled_code[ptr] = compiled
+        self._cache_code(ptr, instruction_len)
+
+        return compiled
+
+    def _compile_block(self, ptr):
+
+        # Find the extent of the block and reuse any previously compiled block with the same
+        # start address and contents, e.g. code which was modified and then restored
+        (block_len, block_instructions) = self._scan_block(ptr)
+        if block_instructions == 0:
+            self.block_counts[ptr] = 0
+            return None
+
+        contents = tuple(self.memory[ptr:ptr+block_len])
+        block = self.block_cache.get((ptr, contents))
+
+        # Otherwise generate a single function executing the instructions in the block in
+        # sequence. Each exit returns the next instruction pointer and the number of
+        # instructions executed, so a write to cached code can leave the block early
+        if block is None:
+            lines = []
+            addr = ptr
+            for count in range(1, block_instructions + 1):
+                exit = lambda next_ptr, count=count: "return ({}, {})".format(next_ptr, count)
+                (instruction_len, opcode) = self._generate_instruction(addr, lines, exit, True)
+                addr += instruction_len
+            if opcode not in self.JumpOpcodes:
+                lines.append(exit(addr))
+
+            compiled = self._compile_function("block_{}".format(ptr), lines)
+            block = (compiled, block_len, block_instructions)
+            self.block_cache[(ptr, contents)] = block
 
             if self.diagnostic_debug:
-                logging.debug("****: ptr {} mem {} opcode {} params {} param_modes {}".format(
-                    self.instruction_ptr, self.memory[self.instruction_ptr], 
-                    opcode, params, param_modes
+                logging.debug("****: Compiled block at {} of {} instructions".format(
+                    ptr, block_instructions
                 ))
 
-            # Execute the instruction
-            instruction(*params, param_modes)
+        # Activate the block, recording its addresses so that a write to any of them
+        # invalidates it
+        self.compiled_blocks[ptr] = block
+        for addr in range(ptr, ptr+block_len):
+            self.block_addrs[addr].add(ptr)
+        self.code_addrs.update(range(ptr, ptr+block_len))
+        if contents == self.program[ptr:ptr+block_len]:
+            self.pristine_blocks.add(ptr)
+
+        return block
+
+    def _scan_block(self, ptr):
+
+        # Return the length and number of instructions of the basic block starting at the
+        # pointer, ending at a terminating instruction, or before an invalid instruction, one
+        # extending beyond the end of the program, or one modified by the program. Modified
+        # instructions are left to the interpreter, as with the threaded engine. An input, which
+        # may suspend execution, can only start a block, so that a block suspended waiting for
+        # input has not executed any other instructions
+        addr = ptr
+        block_instructions = 0
+        while (addr < self.memory_len) and (block_instructions < self.MaxBlockInstructions):
+            if addr in self.modified_code:
+                break
+            try:
+                (opcode, param_modes) = self._parse_instruction(self.memory[addr])
+                instruction_len = self.instructions[opcode][1]
+            except (KeyError, ValueError):
+                break
+            if addr + instruction_len > self.memory_len:
+                break
+            if opcode == self.Opcode.INPUT and block_instructions > 0:
+                break
+
+            addr += instruction_len
+            block_instructions += 1
+            if opcode in self.BlockTerminators:
+                break
+
+        return (addr - ptr, block_instructions)
+
+    def _generate_instruction(self, ptr, lines, exit, exit_on_code_write=False):
+
+        # Get the opcode and parameter modes from memory
+        (opcode, param_modes) = self._parse_instruction(self.memory[ptr])
+
+        try:
+            instruction_len = self.instructions[opcode][1]
+        except KeyError:
+            raise RuntimeError(
+                "Invalid opcode {} at instruction pointer {}".format(opcode, ptr)
+            )
+
+        params = self.memory[ptr+1:ptr+instruction_len]
+        next_ptr = ptr + instruction_len
+
+        # Append lines specialised for the instruction to the function body, with the
+        # parameter modes resolved into direct memory accesses or constants. Jumps transfer
+        # control with the exit statement, other instructions fall through to the next line.
+        # Where specified, writes to cached code also exit, since the code following the write
+        # may have been modified
+        read = lambda idx: self._compile_read(params[idx], param_modes[idx], idx, lines)
+        write = lambda idx: self._compile_write(params[idx], param_modes[idx], idx, lines)
+        store = lambda output, value: lines.extend(self._compile_store(
+            *output, value, exit(next_ptr) if exit_on_code_write else None
+        ))
 
-            # Increment the instruction pointer by the appropriate length
-            self.instruction_ptr += instruction_len
-            num_instructions += 1
+        if opcode in self.CompiledOperators:
+            (value_1, value_2, output) = (read(0), read(1), write(2))
+            store(output, self.CompiledOperators[opcode].format(value_1, value_2))
 
-        # Run complete, set the output parameter to the conents of the first memory position
-        output = self.memory[0]
-        logging.debug("Run completed after {} instructions with output {}".format(
-            num_instructions, output
+        elif opcode == self.Opcode.INPUT:
+            lines.append("proc.instruction_ptr = {}".format(ptr))
+            store(write(0), "proc._read_input()")
+
+        elif opcode == self.Opcode.OUTPUT:
+            lines.append("proc.instruction_ptr = {}".format(ptr))
+            lines.append("proc._write_output({})".format(read(0)))
+
+        elif opcode in self.JumpOpcodes:
+            (value, jump_ptr) = (read(0), read(1))
+            (if_true, if_false) = (jump_ptr, next_ptr)
+            if opcode == self.Opcode.JUMP_FALSE:
+                (if_true, if_false) = (if_false, if_true)
+            lines.append(exit("{} if {} else {}".format(if_true, value, if_false)))
+
+        elif opcode == self.Opcode.ADJ_REL:
+            lines.append("proc.relative_base += {}".format(read(0)))
+
+        else:
+            lines.append("proc.running = False")
+
+        return (instruction_len, opcode)
+
+    def _compile_function(self, name, lines):
+
+        source = "def {}():\n{}\n".format(name, '\n'.join("    " + line for line in lines))
+        namespace = {
+            'proc': self,
+            'mem': self.memory,
+            'code_addrs': self.code_addrs,
+        }
+        exec(source, namespace)
+
+        return namespace[name]
+
+    def _compile_read(self, param, mode, idx, lines):
+
+        if mode == self.ParamMode.IMMEDIATE:
+            return repr(param)
+
+        if mode == self.ParamMode.POSITION:
+            if param < 0:
+                raise RuntimeError("Attempted to access memory below address 0")
+            # Addresses within the program are always present in memory and can be accessed
+            # directly, otherwise the access may need to extend memory or read from a page
+            if param < len(self.program):
+                return "mem[{}]".format(param)
+            addr = repr(param)
+
+        elif mode == self.ParamMode.RELATIVE:
+            addr = "addr_{}".format(idx)
+            lines.append("{} = proc.relative_base + {}".format(addr, param))
+
+        else:
+            raise RuntimeError("Illegal parameter mode {} encountered".format(mode))
+
+        value = "value_{}".format(idx)
+        lines.append("{0} = mem[{1}] if 0 <= {1} < len(mem) else proc._read_extended({1})".format(
+            value, addr
         ))
-        return output
+        return value
+
+    def _compile_write(self, param, mode, idx, lines):
+
+        # Return the address expression for the write and whether it is known to be within the
+        # dense memory
+        if mode == self.ParamMode.RELATIVE:
+            addr = "addr_{}".format(idx)
+            lines.append("{} = proc.relative_base + {}".format(addr, param))
+            return (addr, False)
+
+        return (repr(param), param < len(self.program))
+
+    def _compile_store(self, addr, is_dense, value, code_write_exit=None):
+
+        store = [
+            "mem[{}] = {}".format(addr, value),
+            "if {0} in code_addrs: proc._invalidate_code({0})".format(addr),
+        ]
+        if code_write_exit is not None:
+            store[1:] = [
+                "if {} in code_addrs:".format(addr),
+                "    proc._invalidate_code({})".format(addr),
+                "    " + code_write_exit,
+            ]
+        if is_dense:
+            return store
+
+        return (
+            ["if {} < len(mem):".format(addr)] +
+            ["    " + line for line in store] +
+            ["else:", "    proc._write_extended({}, {})".format(addr, value)]
+        )
+
+    def _cache_code(self, ptr, instruction_len):
+
+        # Record the addresses the cached instruction was decoded from, so that a later write
+        # to any of them (i.e. self-modifying code) invalidates it. Instructions decoded from
+        # unmodified program memory are also marked as surviving a memory reset
+        self.code_spans[ptr] = instruction_len
+        self.code_addrs.update(range(ptr, ptr+instruction_len))
+        if tuple(self.memory[ptr:ptr+instruction_len]) == self.program[ptr:ptr+instruction_len]:
+            self.pristine_code.add(ptr)
+
+    def _invalidate_code(self, addr):
+
+        # Discard any cached instruction whose encoding spans the specified address, marking
+        # its address as modified code
+        for ptr in range(addr - self.max_code_len + 1, addr + 1):
+            instruction_len = self.code_spans.get(ptr)
+            if instruction_len and ptr + instruction_len > addr:
+                if self.diagnostic_debug:
+                    logging.debug("****: Invalidating cached instruction at {}".format(ptr))
+                self._discard_code(ptr)
+                self.modified_code.add(ptr)
+
+        # Similarly discard any compiled block spanning the address, which must become hot
+        # again before its modified code is compiled
+        for ptr in list(self.block_addrs.get(addr, ())):
+            self._discard_block(ptr)
+            self.block_counts[ptr] = 0
+
+    def _discard_code(self, ptr):
+
+        del self.code_spans[ptr]
+        self.decode_cache.pop(ptr, None)
+        self.compiled_code.pop(ptr, None)
+        self.pristine_code.discard(ptr)
+
+    def _discard_block(self, ptr):
+
+        block_len = self.compiled_blocks.pop(ptr)[1]
+        for addr in range(ptr, ptr+block_len):
+            self.block_addrs[addr].discard(ptr)
+        self.pristine_blocks.discard(ptr)
+
+    def _clear_code_cache(self):
+
+        self.decode_cache.clear()
+        self.compiled_code.clear()
+        self.code_spans.clear()
+        self.code_addrs.clear()
+        self.pristine_code.clear()
+        self.modified_code.clear()
+
+        self.block_counts.clear()
+        self.compiled_blocks.clear()
+        self.block_cache.clear()
+        self.block_addrs.clear()
+        self.pristine_blocks.clear()
+
+    def _read_memory(self, addr):
+
+        if 0 <= addr < len(self.memory):
+            return self.memory[addr]
+        return self._read_extended(addr)
+
+    def _write_memory(self, addr, value):
+
+        if addr < len(self.memory):
+            self.memory[addr] = value
+            if addr in self.code_addrs:
+                self._invalidate_code(addr)
+        else:
+            self._write_extended(addr, value)
+
+    def _read_extended(self, addr):
+
+        # Read from beyond the end of the dense memory, extending it if the address is within
+        # the dense limit, otherwise reading from the appropriate page. Pages are not allocated
+        # until written, so reading from a missing page returns zero
+        if addr < 0:
+            raise RuntimeError("Attempted to access memory below address 0")
+
+        if addr < self.dense_limit:
+            self._extend_memory(addr)
+            return self.memory[addr]
+
+        page = self.pages.get(addr // self.MemoryPageSize)
+        if page is None:
+            return 0
+        return page[addr % self.MemoryPageSize]
+
+    def _write_extended(self, addr, value):
+
+        if addr < self.dense_limit:
+            self._extend_memory(addr)
+            self.memory[addr] = value
+            return
+
+        # Allocate the page on first write, or copy it if currently shared with a snapshot
+        page_idx = addr // self.MemoryPageSize
+        page = self.pages.get(page_idx)
+        if page is None:
+            page = [0] * self.MemoryPageSize
+            self.pages[page_idx] = page
+        elif page_idx in self.shared_pages:
+            page = page.copy()
+            self.pages[page_idx] = page
+            self.shared_pages.discard(page_idx)
+
+        page[addr % self.MemoryPageSize] = value
 
     def _parse_instruction(self, instruction):
         
@@ -193,7 +1789,14 @@ class IntCodeProcessor(object):
         remainder = instruction // 100
         param_idx = 0
         while remainder > 0:
+            if param_idx >= len(param_modes):
+                raise ValueError("Instruction {} has too many parameter modes".format(instruction))
             param_modes[param_idx] =  self.ParamMode(remainder % 10)
+            if param_modes[param_idx] not in self.param_modes:
+                raise ValueError("Parameter mode {} requires the {} feature".format(
+                    param_modes[param_idx],
+                    self.ParamModeFeatures[param_modes[param_idx]].name.lower()
+                ))
             remainder = remainder // 10
             param_idx += 1
     
@@ -225,13 +1828,9 @@ class IntCodeProcessor(object):
             else:
                 raise RuntimeError("Illegal parameter mode {} encountered".format(mode))
 
-            if mem_addr < 0:
-                raise RuntimeError("Attempted to access memory below address 0")
-
-            if mem_addr >= len(self.memory):
-                self._extend_memory(mem_addr)
-
-            return self.memory[mem_addr]
+            if 0 <= mem_addr < len(self.memory):
+                return self.memory[mem_addr]
+            return self._read_extended(mem_addr)
 
         return list(map(resolve, params, param_modes))
 
@@ -242,9 +1841,6 @@ class IntCodeProcessor(object):
         else:
             output = output 
 
-        if output >= len(self.memory):
-            self._extend_memory(output)
-
         return output
 
     def _add(self, input_1, input_2, output, param_modes):
@@ -267,47 +1863,72 @@ class IntCodeProcessor(object):
 
         (value_1, value_2) = self._resolve_params((input_1, input_2), param_modes)
         output = self._resolve_output(output, param_modes)
-        self.memory[output] = int(operation(value_1,value_2))
-        
-        op_symbol = self.OpSymbols[operation.__name__]
-        logging.debug(
-            "%s: %04x: %-3s %8x %8x -> %8x", 
-            self.name, self.instruction_ptr, 
-            operation.__name__.upper(), value_1, value_2, output
-        )
+        self._write_memory(output, int(operation(value_1,value_2)))
 
-    def _input(self, input_ptr, param_modes):
+    def _read_input(self):
+
+        if self.frame_method is not None:
+            self._deliver_frames()
 
         if self.is_async:
+            self.status = self.Status.WAITING_FOR_INPUT
+            self.input_wait.set()
             input_value = self.input_queue.get()
+            self.input_wait.clear()
             self.input_queue.task_done()
-            logging.debug("Processor {} input value {}".format(self.name, input_value))
+            self.status = self.Status.RUNNING
         elif self.input_method:
             input_value = self.input_method()
+        elif self.inputs:
+            input_value = self.inputs.popleft()
         else:
-            input_value = self.inputs.pop(0)
-
-        input_ptr = self._resolve_output(input_ptr, [param_modes[0]])
-
-        logging.debug("%s: %04x: INP %8s %8x -> %8x", 
-            self.name, self.instruction_ptr, "[INPUT]", input_value, input_ptr)
+            raise InputRequired
 
-        self.memory[input_ptr] = input_value
+        return input_value
 
-    def _output(self, output_param, param_modes):
-        
-        output_value = self._resolve_params([output_param], param_modes)[0]
-        logging.debug("%s: %04x: OUT %8x %8s -> %8s", 
-            self.name, self.instruction_ptr, output_value, " ", "[OUTPUT]")
+    def _write_output(self, output_value):
 
         if self.is_async:
             self.output_queue.put(output_value)
-            logging.debug("Processor {} output value {}".format(self.name, output_value))
+            if self.output_waiting:
+                self._notify_output()
         elif self.output_method:
             self.output_method(output_value)
         else:
             self.outputs.append(output_value)
 
+    def _deliver_frames(self):
+
+        outputs = self.outputs
+        if self.frame_size is not None:
+            num_values = len(outputs) - (len(outputs) % self.frame_size)
+            frames = list(zip(*[iter(outputs[:num_values])] * self.frame_size))
+        else:
+            frames = []
+            num_values = 0
+            try:
+                while True:
+                    end = outputs.index(self.frame_delimiter, num_values)
+                    frames.append(tuple(outputs[num_values:end]))
+                    num_values = end + 1
+            except ValueError:
+                pass
+
+        if frames:
+            del outputs[:num_values]
+            self.frame_method(frames)
+
+    def _input(self, input_ptr, param_modes):
+
+        input_value = self._read_input()
+        input_ptr = self._resolve_output(input_ptr, [param_modes[0]])
+        self._write_memory(input_ptr, input_value)
+
+    def _output(self, output_param, param_modes):
+        
+        output_value = self._resolve_params([output_param], param_modes)[0]
+        self._write_output(output_value)
+
     def _jump_true(self, input_val, input_jump, param_modes):
         
         self._jump_condition(input_val, input_jump, param_modes, True)
@@ -319,28 +1940,111 @@ class IntCodeProcessor(object):
     def _jump_condition(self, input_val, input_jump, param_modes, condition):
 
         (value, jump_ptr) = self._resolve_params((input_val, input_jump), param_modes)
-        cond_str = "JNE" if condition else "JEQ"
-
-        logging.debug("%s: %04x: %-3s %8x %8s -> %8x", 
-            self.name, self.instruction_ptr, cond_str, value, "", jump_ptr)
-
         if (value != 0) == condition:             
             self.instruction_ptr = jump_ptr - 3
 
     def _adjust_relative(self, adj_param, param_modes):
 
         adjust_relative = self._resolve_params([adj_param], param_modes)[0]
-
-        logging.debug("%s: %04x: ADJ %8x %8x -> %08x", 
-            self.name, self.instruction_ptr, self.relative_base, adjust_relative,
-            self.relative_base + adjust_relative)
-
         self.relative_base += adjust_relative
 
     def _halt(self, param_modes):
-        logging.debug("%s: %04x: HALT", self.name, self.instruction_ptr)
         self.running = False
 
+    def _compare_jump(self, input_1, input_2, output, input_val, jump_ptr, param_modes,
+        operation, condition):
+
+        # Fused comparison and jump conditional on its result, which need not be read back.
+        # The jump target is always an immediate parameter
+        (value_1, value_2) = self._resolve_params((input_1, input_2), param_modes)
+        if param_modes[2] == self.ParamMode.RELATIVE:
+            output += self.relative_base
+            if self._fused_write_conflict(output, 3):
+                self._write_memory(output, int(operation(value_1, value_2)))
+                return True
+
+        if operation(value_1, value_2):
+            self._write_memory(output, 1)
+            if condition:
+                self.instruction_ptr = jump_ptr - 7
+        else:
+            self._write_memory(output, 0)
+            if not condition:
+                self.instruction_ptr = jump_ptr - 7
+
+    def _add_adjust_relative(self, input_1, input_2, output, adj_param, param_modes):
+
+        (value_1, value_2) = self._resolve_params((input_1, input_2), param_modes)
+        if param_modes[2] == self.ParamMode.RELATIVE:
+            output += self.relative_base
+            if self._fused_write_conflict(output, 2):
+                self._write_memory(output, value_1 + value_2)
+                return True
+
+        self._write_memory(output, value_1 + value_2)
+        self.relative_base += self._resolve_params([adj_param], param_modes[3:])[0]
+
+    def _fused_write_conflict(self, output, next_len):
+
+        # If the first instruction of a fused pair writes to the second, the instruction
+        # pointer is moved so that the modified instruction is decoded and executed separately
+        next_ptr = self.instruction_ptr + 4
+        if next_ptr <= output < next_ptr + next_len:
+            self.instruction_ptr -= next_len
+            return True
+        return False
+
+    def _trace_instruction(self, ptr, opcode, params, param_modes):
+
+        # Format trace lines for an instruction in the disassembly format, resolving the
+        # parameter values before it is executed
+        if opcode in self.TraceMnemonics:
+            (value_1, value_2) = self._resolve_params(params[:2], param_modes)
+            output = self._resolve_output(params[2], param_modes)
+            return ["%s: %04x: %-3s %8x %8x -> %8x" % (
+                self.name, ptr, self.TraceMnemonics[opcode], value_1, value_2, output
+            )]
+
+        if opcode == self.Opcode.OUTPUT:
+            output_value = self._resolve_params(params, param_modes)[0]
+            lines = ["%s: %04x: OUT %8x %8s -> %8s" % (
+                self.name, ptr, output_value, " ", "[OUTPUT]"
+            )]
+            if self.is_async:
+                lines.append("Processor {} output value {}".format(self.name, output_value))
+            return lines
+
+        if opcode in (self.Opcode.JUMP_TRUE, self.Opcode.JUMP_FALSE):
+            (value, jump_ptr) = self._resolve_params(params, param_modes)
+            cond_str = "JNE" if opcode == self.Opcode.JUMP_TRUE else "JEQ"
+            return ["%s: %04x: %-3s %8x %8s -> %8x" % (
+                self.name, ptr, cond_str, value, "", jump_ptr
+            )]
+
+        if opcode == self.Opcode.ADJ_REL:
+            adjust_relative = self._resolve_params(params, param_modes)[0]
+            return ["%s: %04x: ADJ %8x %8x -> %08x" % (
+                self.name, ptr, self.relative_base, adjust_relative,
+                self.relative_base + adjust_relative
+            )]
+
+        return ["%s: %04x: HALT" % (self.name, ptr)]
+
+    def _trace_input(self, ptr, params, param_modes):
+
+        # Format trace lines for an input instruction after it has been executed, so that the
+        # value read is known
+        input_ptr = self._resolve_output(params[0], [param_modes[0]])
+        input_value = self._read_memory(input_ptr)
+
+        lines = []
+        if self.is_async:
+            lines.append("Processor {} input value {}".format(self.name, input_value))
+        lines.append("%s: %04x: INP %8s %8x -> %8x" % (
+            self.name, ptr, "[INPUT]", input_value, input_ptr
+        ))
+        return lines
+
     def run_self_test_cases(self, name, test_cases, test_results=[], test_inputs=[], test_outputs=[]):
 
         if len(test_results) == 0:
@@ -373,7 +2077,10 @@ class IntCodeProcessor(object):
             [1,0,0,0,99] ,
             [2,3,0,3,99],
             [2,4,4,5,99,0],
-            [1,1,1,4,99,5,6,0,99]
+            [1,1,1,4,99,5,6,0,99],
+            [1107,1,2,9,1005,9,10,99,0,0,104,7,99],
+            [109,5,21107,2,1,2,1205,2,10,99,104,42,99],
+            [1101,1,98,4,1111199],
         ]
 
         test_results = [
@@ -382,10 +2089,38 @@ class IntCodeProcessor(object):
             [2,0,0,0,99],
             [2,3,0,6,99],
             [2,4,4,5,99,9801],
-            [30,1,1,4,2,5,6,0,99]
+            [30,1,1,4,2,5,6,0,99],
+            [1107,1,2,9,1005,9,10,99,0,1,104,7,99],
+            [109,5,21107,2,1,2,1205,0,10,99,104,42,99],
+            [1101,1,98,4,99],
         ]
 
-        self.run_self_test_cases('Basic', test_cases, test_results)
+        # The next two cases exercise a fused comparison and jump, the second with the
+        # comparison modifying the jump, and the last an add followed by a word with too
+        # many parameter modes to decode, which it overwrites with a halt. Each is only run
+        # with the features it requires
+        test_outputs = [[]] * 6 + [[7], [42], []]
+        test_features = [self.Feature.BASIC] * 6 + \
+            [self.Feature.IO, self.Feature.RELATIVE, self.Feature.IO]
+
+        selected = [test_feature <= self.features for test_feature in test_features]
+        test_cases = [test_case for (test_case, select) in zip(test_cases, selected) if select]
+        test_results = [test_result for (test_result, select) in zip(test_results, selected) if select]
+        test_outputs = [test_output for (test_output, select) in zip(test_outputs, selected) if select]
+        self.run_self_test_cases('Basic', test_cases, test_results, test_outputs=test_outputs)
+
+        # Opcodes and parameter modes beyond the selected features are rejected
+        for (test_case, test_feature) in zip(
+            [[1101,1,2,0,99], [2,0,0,0,3,0,99], [109,1,99], [201,1,2,0,99]],
+            [self.Feature.IO, self.Feature.IO, self.Feature.RELATIVE, self.Feature.RELATIVE]):
+            if test_feature <= self.features:
+                continue
+            self.load_program(test_case)
+            try:
+                self.run()
+                assert False
+            except (RuntimeError, ValueError):
+                pass
 
     def self_test_part1(self):
 
@@ -501,6 +2236,895 @@ class IntCodeProcessor(object):
         ]
         self.run_self_test_cases('Part 2b', test_cases, test_results, test_inputs, test_outputs)
 
+    def self_test_replay(self):
+
+        # Record a session which reads input part way through, then check that seeking to
+        # each instruction gives the same state as running that many instructions afresh
+        test_program = [
+            1101,0,3,20,1001,20,-1,20,1005,20,4,
+            3,21,1008,21,8,22,4,22,99,0,0,0
+        ]
+        recorder = SessionRecorder(checkpoint_interval=4)
+        self.load_program(test_program)
+        self.attach_recorder(recorder)
+        self.load_inputs([8])
+        self.run()
+        self.attach_recorder(None)
+        assert self.outputs == [1]
+        assert recorder.input_counts == [7] and recorder.input_values == [8]
+
+        for instruction_count in range(self.instruction_count + 1):
+            proc = recorder.seek(instruction_count, self.engine)
+            self.load_program(test_program)
+            self.load_inputs([8])
+            self.run(max_instructions=instruction_count)
+            assert proc.instruction_count == self.instruction_count == instruction_count
+            assert proc.instruction_ptr == self.instruction_ptr
+            assert proc.memory == self.memory
+
+        # A session writing to a memory page is saved and loaded with the same checkpoints,
+        # and replays to the same states
+        test_program = [3,100000, 1001,100000,1,100001, 4,100001, 99]
+        recorder = SessionRecorder(checkpoint_interval=1)
+        self.load_program(test_program)
+        self.attach_recorder(recorder)
+        self.load_inputs([41])
+        self.run()
+        self.attach_recorder(None)
+        assert self.outputs == [42]
+        with tempfile.TemporaryDirectory() as dir_name:
+            file_name = os.path.join(dir_name, 'session.json.gz')
+            recorder.save(file_name)
+            loaded = SessionRecorder.load(file_name)
+        assert loaded.__dict__ == recorder.__dict__
+        for instruction_count in range(self.instruction_count + 1):
+            proc = loaded.seek(instruction_count, self.engine)
+            expected = recorder.seek(instruction_count, self.engine)
+            assert proc.snapshot() == expected.snapshot()
+        assert proc.pages
+
+        # A fused comparison writing to the jump following it only executes the comparison,
+        # which is counted as a single instruction
+        test_program = [109,5,21107,2,1,2,1205,2,10,99,104,42,99]
+        recorder = SessionRecorder(checkpoint_interval=2)
+        self.load_program(test_program)
+        self.attach_recorder(recorder)
+        self.run()
+        self.attach_recorder(None)
+        for (instruction_count, instruction_ptr) in enumerate([0, 2, 6, 10, 12, 13]):
+            proc = recorder.seek(instruction_count, self.engine)
+            self.load_program(test_program)
+            self.run(max_instructions=instruction_count)
+            assert proc.instruction_ptr == self.instruction_ptr == instruction_ptr
+            assert proc.instruction_count == self.instruction_count == instruction_count
+
+        logging.info("Replay test cases completed OK")
+
+    def self_test_profiler(self):
+
+        # Profile a loop counting down from its input, outputting each count, checking the
+        # counts by opcode, address and block, where blocks start after the input and jump
+        test_program = [3,20, 1001,20,-1,20, 4,20, 1005,20,2, 99]
+        profiler = Profiler()
+        self.load_program(test_program)
+        self.attach_profiler(profiler)
+        self.load_inputs([3])
+        self.run()
+        self.attach_profiler(None)
+        assert self.outputs == [2, 1, 0]
+
+        assert (profiler.num_runs, profiler.num_instructions, profiler.num_outputs) == (1, 11, 3)
+        assert profiler.opcode_counts == {
+            self.Opcode.INPUT: 1, self.Opcode.ADD: 3, self.Opcode.OUTPUT: 3,
+            self.Opcode.JUMP_TRUE: 3, self.Opcode.HALT: 1,
+        }
+        assert profiler.address_counts == {0: 1, 2: 3, 6: 3, 8: 3, 11: 1}
+        assert profiler.block_counts == {0: 1, 2: 3, 11: 1}
+        assert profiler.get_folded_lines() == [
+            "{};block_0000;INPUT 1".format(self.name),
+            "{};block_0002;ADD 3".format(self.name),
+            "{};block_0002;OUTPUT 3".format(self.name),
+            "{};block_0002;JUMP_TRUE 3".format(self.name),
+            "{};block_000b;HALT 1".format(self.name),
+        ]
+
+        logging.info("Profiler test cases completed OK")
+
+    def self_test_snapshot(self):
+
+        # A program reading an input to a sparse page, then adding a second input to it. The
+        # snapshot taken with the second input pending must be unaffected by later writes to
+        # the page, and both the fork and the restored processor resume from it
+        test_program = [3,100000, 3,30, 1,100000,30,31, 4,31, 99]
+        self.load_program(test_program)
+        self.load_inputs([5])
+        self.run()
+        assert self.status == self.Status.NEEDS_INPUT and self.pages
+
+        self.load_inputs([10])
+        snapshot = self.snapshot()
+        assert snapshot.inputs == (10,)
+        proc = self.fork()
+
+        self.set_memory(100000, 7)
+        self.run()
+        assert self.outputs == [17]
+
+        proc.run()
+        assert proc.outputs == [15]
+        assert proc.instruction_count == self.instruction_count == 5
+
+        self.restore(snapshot)
+        self.run()
+        assert self.outputs == [15]
+
+        logging.info("Snapshot test cases completed OK")
+
+    def self_test_batch(self):
+
+        # Check that batch runs give the same outputs as individual runs, for a program using
+        # relative mode and reading memory beyond the end of the memory matrix, with a patch
+        # to an address beyond it
+        test_program = [
+            109,1000, 203,0, 22102,2,0,1, 204,1, 4,50000, 21207,0,5,2, 204,2, 4,10000, 99
+        ]
+        test_inputs = [[1], [7], [3], [5]]
+        patches = {10000: 5}
+
+        self.load_program(test_program)
+        outputs = self.run_batch(test_inputs, patches)
+        cache = FunctionCache()
+        assert outputs == [
+            list(self.run_function(test_input, patches, cache)) for test_input in test_inputs
+        ]
+        assert outputs[1] == [14, 0, 0, 5]
+
+        logging.info("Batch test cases completed OK")
+
+    def self_test_trace(self):
+
+        # Trace a program to a callback, capturing every line, and to a ring buffer holding
+        # only the most recent lines
+        test_program = [3,9, 1001,9,1,9, 4,9, 99, 0]
+        test_lines = [
+            'IntCode: 0000: INP  [INPUT]        4 ->        9',
+            'IntCode: 0002: ADD        4        1 ->        9',
+            'IntCode: 0006: OUT        5          -> [OUTPUT]',
+            'IntCode: 0008: HALT',
+        ]
+        lines = []
+        ring_buffer = RingBufferTraceSink(capacity=3)
+        for trace_sink in (CallbackTraceSink(lines.append), ring_buffer):
+            self.load_program(test_program)
+            self.attach_trace_sink(trace_sink)
+            self.load_inputs([4])
+            self.run()
+            self.attach_trace_sink(None)
+            assert self.outputs == [5]
+        assert lines == test_lines
+        assert ring_buffer.get_lines() == test_lines[-3:]
+
+        logging.info("Trace test cases completed OK")
+
+    def self_test_step_until(self):
+
+        # Step until an output is produced, then until the pointer reaches an address, then for
+        # at most one instruction, stopping on input and resuming to the halt once it is given
+        test_program = [104,1, 1101,2,3,11, 104,2, 3,12, 99, 0, 0]
+        self.load_program(test_program)
+        assert self.step_until(lambda proc: len(proc.outputs) > 0) == self.Status.BUDGET_EXHAUSTED
+        assert (self.instruction_ptr, self.outputs) == (2, [1])
+        assert self.step_until(lambda proc: proc.instruction_ptr == 6) == \
+            self.Status.BUDGET_EXHAUSTED
+        assert (self.instruction_ptr, self.memory[11]) == (6, 5)
+        assert self.step_until(lambda proc: False, max_instructions=1) == \
+            self.Status.BUDGET_EXHAUSTED
+        assert (self.instruction_ptr, self.outputs) == (8, [1, 2])
+        assert self.step_until(lambda proc: False) == self.Status.NEEDS_INPUT
+        assert self.instruction_ptr == 8
+        self.load_inputs([7])
+        assert self.step_until(lambda proc: False, max_instructions=10) == self.Status.HALTED
+        assert (self.memory[12], self.instruction_count) == (7, 5)
+
+        logging.info("Step until test cases completed OK")
+
+    def self_test_hot_blocks(self):
+
+        # Rerun a program whose block is followed by a word which cannot be decoded, and
+        # which the block overwrites, until the JIT engine has compiled the block
+        test_program = [1101,1,98,4,1111199]
+        self.load_program(test_program)
+        for _ in range(self.HotBlockThreshold + 2):
+            self.reset_memory()
+            self.run()
+            assert self.status == self.Status.HALTED
+            assert self.memory == [1101,1,98,4,99]
+        if self.engine == self.Engine.JIT:
+            assert self.compiled_blocks[0][2] == 1
+
+        logging.info("Hot block test cases completed OK")
+
+    def self_test_function(self):
+
+        # Check that outputs are memoized by program, patches and inputs, using a program which
+        # outputs whether its input is equal to the value at address 10, or less than it
+        cache = FunctionCache(max_size=2)
+        self.load_program([3,9,8,9,10,9,4,9,99,-1,8])
+        assert self.run_function([8], cache=cache) == (1,)
+        assert self.run_function([7], cache=cache) == (0,)
+        assert self.run_function([8], cache=cache) == (1,)
+        assert self.run_function([7], patches={2: 7}, cache=cache) == (1,)
+        assert (cache.hits, cache.misses, len(cache.entries)) == (1, 3, 2)
+
+        self.load_program([3,9,7,9,10,9,4,9,99,-1,8])
+        assert self.run_function([7], cache=cache) == (1,)
+        assert cache.hits == 1
+
+        logging.info("Function test cases completed OK")
+
+class AsyncIntCodeProcessor(IntCodeProcessor):
+
+    # Processor running as an asyncio coroutine, with inputs and outputs passed through asyncio
+    # queues. Execution only yields to the event loop when waiting for input, or each time the
+    # instruction budget is used, so that many processors can share a single event loop
+
+    def __init__(self, program=[], name="IntCode", engine=IntCodeProcessor.Engine.INTERPRETER,
+        instruction_budget=10000):
+
+        super().__init__(program, name, False, engine)
+
+        self.instruction_budget = instruction_budget
+        self.input_queue = asyncio.Queue()
+        self.output_queue = asyncio.Queue()
+
+    async def run(self):
+
+        while True:
+
+            self._run(self.instruction_budget)
+
+            if self.status == self.Status.HALTED:
+                return self.memory[0]
+
+            if self.status == self.Status.NEEDS_INPUT:
+                # Wait for an input value, then take any others already queued
+                self.inputs.append(await self.input_queue.get())
+                while not self.input_queue.empty():
+                    self.inputs.append(self.input_queue.get_nowait())
+            else:
+                await asyncio.sleep(0)
+
+    def _create_fork(self):
+
+        # The fork has its own queues, with any inputs not yet taken from the input queue of
+        # this processor left there
+        return AsyncIntCodeProcessor(
+            self.program, self.name, self.engine, self.instruction_budget
+        )
+
+    def coroutine(self):
+
+        raise RuntimeError("Asynchronous processors run as asyncio coroutines")
+
+    def run_function(self, inputs, patches={}, cache=None):
+
+        raise RuntimeError("Asynchronous processors cannot be run as functions")
+
+    def attach_prefix(self, num_instructions, input_addrs):
+
+        raise RuntimeError("Asynchronous processors cannot be run as functions")
+
+    def _write_output(self, output_value):
+
+        self.output_queue.put_nowait(output_value)
+
+class SessionRecorder(object):
+
+    # Records a processor session as the inputs it reads, each with the number of instructions
+    # executed before it was read, and checkpoints of the processor state taken at intervals.
+    # Since execution is deterministic given the inputs, the session can be replayed to any
+    # instruction by restoring the nearest preceding checkpoint and running on from there
+    def __init__(self, checkpoint_interval=100000):
+
+        self.checkpoint_interval = checkpoint_interval
+        self.program = None
+        self.name = None
+        self.features = None
+        self.input_counts = []
+        self.input_values = []
+        self.checkpoints = []
+
+    def check_checkpoint(self, proc, instruction_count):
+
+        if self.checkpoints and \
+            instruction_count - self.checkpoints[-1][0] < self.checkpoint_interval:
+            return
+
+        if self.program is None:
+            (self.program, self.name, self.features) = (proc.program, proc.name, proc.features)
+
+        # Pending inputs are not checkpointed, being replayed from the input log instead, and
+        # the instruction count of the processor is only updated when a run stops
+        snapshot = proc.snapshot()._replace(
+            inputs=(), outputs=(), instruction_count=instruction_count
+        )
+        self.checkpoints.append((instruction_count, len(self.input_values), snapshot))
+
+    def record_input(self, instruction_count, input_value):
+
+        self.input_counts.append(instruction_count)
+        self.input_values.append(input_value)
+
+    def get_num_instructions(self):
+
+        return self.checkpoints[-1][0] if self.checkpoints else 0
+
+    def seek(self, instruction_count, engine=IntCodeProcessor.Engine.INTERPRETER):
+
+        # Return a new processor in the state of the session after the specified number of
+        # instructions, with the inputs read after that point loaded. Outputs are those
+        # produced since the checkpoint restored
+        idx = bisect.bisect_right([checkpoint[0] for checkpoint in self.checkpoints],
+            instruction_count) - 1
+        if idx < 0:
+            raise RuntimeError("No checkpoint recorded before instruction {}".format(
+                instruction_count
+            ))
+        (checkpoint_count, input_idx, snapshot) = self.checkpoints[idx]
+
+        proc = IntCodeProcessor(self.program, self.name, engine=engine, features=self.features)
+        proc.restore(snapshot)
+        proc.load_inputs(self.input_values[input_idx:])
+
+        if instruction_count > checkpoint_count:
+            proc.run(max_instructions=instruction_count - checkpoint_count)
+            if proc.instruction_count != instruction_count:
+                raise RuntimeError("Session ended after {} instructions".format(
+                    proc.instruction_count
+                ))
+
+        return proc
+
+    def save(self, file_name):
+
+        # Sessions are saved as gzipped JSON, rather than pickled, so that loading a session
+        # file cannot execute code. Pages are saved as lists of index and contents, since JSON
+        # object keys must be strings
+        session = {
+            'checkpoint_interval': self.checkpoint_interval,
+            'program': self.program,
+            'name': self.name,
+            'features': self.features,
+            'input_counts': self.input_counts,
+            'input_values': self.input_values,
+            'checkpoints': [
+                (instruction_count, input_idx,
+                    dict(snapshot._asdict(), pages=sorted(snapshot.pages.items())))
+                for (instruction_count, input_idx, snapshot) in self.checkpoints
+            ],
+        }
+        with gzip.open(file_name, 'wt') as f:
+            json.dump(session, f)
+
+    @classmethod
+    def load(cls, file_name):
+
+        with gzip.open(file_name, 'rt') as f:
+            session = json.load(f)
+
+        recorder = cls(session['checkpoint_interval'])
+        if session['program'] is not None:
+            recorder.program = tuple(session['program'])
+            recorder.name = session['name']
+            recorder.features = IntCodeProcessor.Feature(session['features'])
+        recorder.input_counts = session['input_counts']
+        recorder.input_values = session['input_values']
+        for (instruction_count, input_idx, snapshot) in session['checkpoints']:
+            snapshot = ProcessorSnapshot(
+                tuple(snapshot['memory']), dict(snapshot['pages']), snapshot['instruction_ptr'],
+                snapshot['relative_base'], IntCodeProcessor.Status(snapshot['status']),
+                tuple(snapshot['inputs']), tuple(snapshot['outputs']),
+                snapshot['instruction_count']
+            )
+            recorder.checkpoints.append((instruction_count, input_idx, snapshot))
+
+        return recorder
+
+class Scheduler(object):
+
+    # Runs a set of processors cooperatively in a single thread. Each processor is run as a
+    # coroutine until it halts or is suspended waiting for input, when the next processor in
+    # the run queue is resumed. Connected processors pass values directly from the output of
+    # one to the input deque of the next
+
+    def __init__(self, procs=[]):
+
+        self.procs = list(procs)
+
+    def add(self, proc):
+
+        self.procs.append(proc)
+
+    def connect(self, source, dest):
+
+        source.attach_output_method(dest.inputs.append)
+
+    def run(self):
+
+        run_queue = collections.deque((proc, proc.coroutine()) for proc in self.procs)
+        num_blocked = 0
+
+        while run_queue:
+
+            (proc, coroutine) = run_queue.popleft()
+
+            # Skip processors still waiting for input, detecting when none can make progress
+            if proc.status == proc.Status.NEEDS_INPUT and not proc.inputs:
+                num_blocked += 1
+                if num_blocked > len(run_queue):
+                    raise RuntimeError("All scheduled processors are blocked waiting for input")
+                run_queue.append((proc, coroutine))
+                continue
+            num_blocked = 0
+
+            try:
+                next(coroutine)
+            except StopIteration:
+                continue
+            run_queue.append((proc, coroutine))
+
+# Processor used by each process pool worker, created once per worker with the pool program
+_pool_processor = None
+
+def _init_pool_worker(program, engine, features):
+
+    global _pool_processor
+    _pool_processor = IntCodeProcessor(
+        program, name='PoolWorker', engine=engine, features=features
+    )
+
+def _run_pool_job(job):
+
+    (inputs, patches) = job
+
+    _pool_processor.reset_memory()
+    for (addr, value) in patches.items():
+        _pool_processor.set_memory(addr, value)
+    _pool_processor.load_inputs(list(inputs))
+    output = _pool_processor.run()
+
+    return (output, _pool_processor.get_outputs())
+
+def _run_pool_jobs(indexed_jobs):
+
+    return [(idx, _run_pool_job(job)) for (idx, job) in indexed_jobs]
+
+class ProcessorPool(object):
+
+    # Runs independent jobs for a program across a pool of worker processes. Each job is a
+    # tuple of inputs and a dict of memory patches, and gives a result tuple of the run output
+    # (the contents of address 0) and the list of outputs. The program is sent to each worker
+    # once, when it starts
+
+    def __init__(self, program, max_workers=None, engine=IntCodeProcessor.Engine.THREADED,
+        features=IntCodeProcessor.Feature.RELATIVE):
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_pool_worker,
+            initargs=(list(program), engine, features)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, inputs=[], patches={}):
+
+        return self.executor.submit(_run_pool_job, (inputs, patches))
+
+    def map(self, jobs, chunksize=100):
+
+        # Yield job results in the order of the jobs
+        return self.executor.map(_run_pool_job, jobs, chunksize=chunksize)
+
+    def map_unordered(self, jobs, chunksize=100):
+
+        # Yield (job index, result) tuples as chunks of jobs complete
+        indexed_jobs = list(enumerate(jobs))
+        futures = [
+            self.executor.submit(_run_pool_jobs, indexed_jobs[idx:idx+chunksize])
+            for idx in range(0, len(indexed_jobs), chunksize)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+
+    def shutdown(self):
+
+        self.executor.shutdown(cancel_futures=True)
+
+class NetworkShard(object):
+
+    # Hosts the machines of a network at a subset of its addresses. Each round, every machine
+    # which has not halted is run until it needs input or has used its instruction budget.
+    # A machine needing input with no packet waiting is given -1. Packets between machines in
+    # the shard are delivered directly, and all others are returned for routing
+
+    NoPacket = -1
+
+    def __init__(self, program, addresses, instruction_budget, engine):
+
+        self.machines = {}
+        self.outgoing = []
+        self.num_sent = 0
+        self.instruction_budget = instruction_budget
+
+        for address in addresses:
+            proc = IntCodeProcessor(program, 'Machine{}'.format(address), engine=engine)
+            proc.attach_frame_method(self._send_packets, frame_size=3)
+            proc.load_inputs([address])
+            self.machines[address] = proc
+
+    def _send_packets(self, packets):
+
+        self.num_sent += len(packets)
+        for (dest, x, y) in packets:
+            if dest in self.machines:
+                self.machines[dest].inputs.extend((x, y))
+            else:
+                self.outgoing.append((dest, x, y))
+
+    def run_round(self, packets):
+
+        # Run a round with the incoming packets, returning the outgoing packets and whether
+        # the shard was idle, i.e. no packets were received or sent and every machine which
+        # has not halted is waiting for input
+        for (dest, x, y) in packets:
+            self.machines[dest].inputs.extend((x, y))
+        self.num_sent = 0
+        is_idle = not packets
+
+        for proc in self.machines.values():
+            if proc.status == proc.Status.HALTED:
+                continue
+            if proc.status == proc.Status.NEEDS_INPUT and not proc.inputs:
+                proc.inputs.append(self.NoPacket)
+            elif proc.inputs:
+                is_idle = False
+            proc.run(max_instructions=self.instruction_budget)
+            if proc.status not in (proc.Status.NEEDS_INPUT, proc.Status.HALTED):
+                is_idle = False
+
+        (outgoing, self.outgoing) = (self.outgoing, [])
+
+        return (outgoing, is_idle and self.num_sent == 0)
+
+def _run_network_shard(conn, program, addresses, instruction_budget, engine):
+
+    # Run a network shard in a worker process, running a round for each list of incoming
+    # packets received until None is received
+    shard = NetworkShard(program, addresses, instruction_budget, engine)
+    while True:
+        packets = conn.recv()
+        if packets is None:
+            break
+        conn.send(shard.run_round(packets))
+    conn.close()
+
+class Network(object):
+
+    # Runs a network of machines addressed 0 to N-1, each running the same program, which are
+    # booted with their address as their first input and send packets as output triples of
+    # destination address, x and y. Machines are run in rounds in a single thread, each for an
+    # instruction budget or until it needs input, with packets sent in one round received in
+    # the next. Packets to addresses outside the network are passed to the external method.
+    # When the network has been idle for the idle rounds, the idle method is called with the
+    # network, to send packets or stop it. Optionally the machines are sharded across worker
+    # processes, which each run their shard of the network in rounds in parallel
+
+    DefaultInstructionBudget = 1000
+    IdleRounds = 2
+
+    def __init__(self, program, num_machines, instruction_budget=DefaultInstructionBudget,
+        engine=IntCodeProcessor.Engine.THREADED, num_shards=1):
+
+        self.num_machines = num_machines
+        self.external_method = None
+        self.idle_method = None
+        self.pending = []
+        self.running = False
+        self.num_rounds = 0
+        self.num_packets = 0
+
+        # Addresses are assigned to shards in turn, so that the shards are balanced
+        shard_addresses = [
+            list(range(num_machines))[idx::num_shards] for idx in range(num_shards)
+        ]
+        self.shard_index = {
+            address: idx for (idx, addresses) in enumerate(shard_addresses)
+            for address in addresses
+        }
+
+        self.shard = None
+        self.workers = []
+        if num_shards == 1:
+            self.shard = NetworkShard(program, range(num_machines), instruction_budget, engine)
+        else:
+            for addresses in shard_addresses:
+                (conn, worker_conn) = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_run_network_shard, daemon=True,
+                    args=(worker_conn, tuple(program), addresses, instruction_budget, engine)
+                )
+                process.start()
+                self.workers.append((process, conn))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def attach_external_method(self, external_method):
+
+        self.external_method = external_method
+
+    def attach_idle_method(self, idle_method):
+
+        self.idle_method = idle_method
+
+    def send(self, dest, x, y):
+
+        if not 0 <= dest < self.num_machines:
+            raise RuntimeError("Packet sent to address {} outside the network".format(dest))
+        self.pending.append((dest, x, y))
+
+    def stop(self):
+
+        self.running = False
+
+    def _run_round(self, packets):
+
+        if self.shard is not None:
+            return self.shard.run_round(packets)
+
+        shard_packets = [[] for _ in self.workers]
+        for packet in packets:
+            shard_packets[self.shard_index[packet[0]]].append(packet)
+        for ((_, conn), packets) in zip(self.workers, shard_packets):
+            conn.send(packets)
+
+        outgoing = []
+        is_idle = True
+        for (_, conn) in self.workers:
+            (shard_outgoing, shard_idle) = conn.recv()
+            outgoing.extend(shard_outgoing)
+            is_idle = is_idle and shard_idle
+
+        return (outgoing, is_idle)
+
+    def run(self, max_rounds=None):
+
+        # Run rounds until the network is stopped, or for the maximum number of rounds
+        self.running = True
+        idle_rounds = 0
+
+        while self.running and (max_rounds is None or max_rounds > 0):
+
+            (packets, self.pending) = (self.pending, [])
+            (outgoing, is_idle) = self._run_round(packets)
+            self.num_rounds += 1
+            self.num_packets += len(outgoing)
+            if max_rounds is not None:
+                max_rounds -= 1
+
+            for (dest, x, y) in outgoing:
+                if dest in self.shard_index:
+                    self.pending.append((dest, x, y))
+                elif self.external_method is not None:
+                    self.external_method(dest, x, y)
+                else:
+                    raise RuntimeError("Packet sent to address {} outside the network".format(
+                        dest
+                    ))
+
+            idle_rounds = idle_rounds + 1 if is_idle and not self.pending else 0
+            if idle_rounds < self.IdleRounds or not self.running:
+                continue
+
+            logging.debug("Network idle after {} rounds".format(self.num_rounds))
+            if self.idle_method is not None:
+                self.idle_method(self)
+            if self.running and not self.pending:
+                raise RuntimeError("Network idle with no packets to send")
+            idle_rounds = 0
+
+    def shutdown(self):
+
+        for (process, conn) in self.workers:
+            conn.send(None)
+            process.join()
+            conn.close()
+        self.workers = []
+
+def test_async_outputs():
+
+    # Outputs three values through a queue with a capacity of one, then echoes its input
+    for channel_type in (queue.Queue, RingBufferChannel):
+        proc = IntCodeProcessor(
+            [104,1, 104,2, 104,3, 3,20, 4,20, 99], is_async=True, channel_type=channel_type,
+            output_capacity=1
+        )
+        proc.attach_input_queue(channel_type())
+        proc.run()
+        assert [proc.get_output() for _ in range(3)] == [1, 2, 3]
+        assert proc.input_wait.wait(timeout=10)
+        assert proc.status == proc.Status.WAITING_FOR_INPUT
+        try:
+            proc.get_output(timeout=0)
+            assert False
+        except queue.Empty:
+            pass
+        proc.input_queue.put(7)
+        assert proc.get_output() == 7
+        assert proc.get_output() is None
+        assert proc.halted.is_set() and proc.status == proc.Status.HALTED
+        proc.run_thread.join()
+
+    logging.info("Async output test cases completed OK")
+
+def test_program_image():
+
+    # Convert a program with negative and 64-bit values to an image, read it back through
+    # the mapping and run it, then check that corrupt images are rejected
+    test_program = [1101,-7,4294967296,11, 4,11, 1,11,11,0, 99, 0]
+    with tempfile.TemporaryDirectory() as dir_name:
+        text_file_name = os.path.join(dir_name, 'program.txt')
+        image_file_name = os.path.join(dir_name, 'program.img')
+        with open(text_file_name, 'w') as f:
+            f.write(','.join(str(value) for value in test_program) + '\n')
+        convert_program_file(text_file_name, image_file_name)
+
+        program = read_program_image(image_file_name)
+        assert program.tolist() == test_program and not program.flags.writeable
+        del program
+
+        results = []
+        for file_name in (text_file_name, image_file_name):
+            proc = IntCodeProcessor()
+            proc.load_file(file_name)
+            assert proc.program == tuple(test_program)
+            results.append((proc.run(), proc.get_outputs()))
+        assert results[0] == results[1] == (8589934578, [4294967289])
+
+        with open(image_file_name, 'rb') as f:
+            image = f.read()
+        # Corrupt the first byte of the magic and the last byte of the hash
+        for (offset, message) in ((0, "not a program image"),
+            (ProgramImageHeader.size - 1, "failed hash check")):
+            corrupt_image = bytearray(image)
+            corrupt_image[offset] ^= 0xff
+            with open(image_file_name, 'wb') as f:
+                f.write(corrupt_image)
+            try:
+                read_program_image(image_file_name)
+                assert False
+            except RuntimeError as e:
+                assert message in str(e)
+        with open(image_file_name, 'wb') as f:
+            f.write(image[:-8])
+        try:
+            read_program_image(image_file_name)
+            assert False
+        except RuntimeError as e:
+            assert "incorrect length" in str(e)
+
+    logging.info("Program image test cases completed OK")
+
+def test_processor_pool():
+
+    # Triples the input, outputting the result and adding the value at address 13 to give
+    # the run output. Results from the pool must match those of serial runs
+    test_program = [3,14, 1002,14,3,15, 4,15, 1,15,13,0, 99, 0, 0, 0]
+    jobs = [([value], {13: value % 3}) for value in range(10)]
+
+    proc = IntCodeProcessor(test_program)
+    expected = []
+    for (inputs, patches) in jobs:
+        proc.reset_memory()
+        for (addr, value) in patches.items():
+            proc.set_memory(addr, value)
+        proc.load_inputs(inputs)
+        expected.append((proc.run(), proc.get_outputs()))
+    assert expected[4] == (13, [12])
+
+    with ProcessorPool(test_program, max_workers=2) as pool:
+        assert list(pool.map(jobs, chunksize=3)) == expected
+        assert sorted(pool.map_unordered(jobs, chunksize=3)) == list(enumerate(expected))
+        assert pool.submit([4], {13: 1}).result() == expected[4]
+    try:
+        pool.submit([4])
+        assert False
+    except RuntimeError:
+        pass
+
+    logging.info("Processor pool test cases completed OK")
+
+def test_async_processor():
+
+    # A countdown loop run with a small instruction budget yields to the event loop each time
+    # the budget is used, so another task sees the instruction count advance in steps of it
+    test_program = [3,20, 1001,20,-1,20, 1005,20,2, 4,20, 99]
+    proc = AsyncIntCodeProcessor(test_program, instruction_budget=10)
+    instruction_counts = []
+
+    async def run_with_ticker():
+        async def ticker():
+            while True:
+                instruction_counts.append(proc.instruction_count)
+                await asyncio.sleep(0)
+        task = asyncio.ensure_future(ticker())
+        proc.input_queue.put_nowait(100)
+        await proc.run()
+        task.cancel()
+
+    asyncio.run(run_with_ticker())
+    assert instruction_counts == list(range(10, 210, 10))
+    assert proc.output_queue.get_nowait() == 0
+    assert proc.instruction_count == 203
+
+    # A fork part way through the loop is also asynchronous, and runs on to the same output
+    proc.reset_memory()
+    proc.load_inputs([5])
+    assert proc.step_until(lambda proc: proc.instruction_ptr == 9) == \
+        proc.Status.BUDGET_EXHAUSTED
+    fork = proc.fork()
+    assert isinstance(fork, AsyncIntCodeProcessor) and fork.instruction_budget == 10
+    assert asyncio.run(fork.run()) == 3
+    assert fork.output_queue.get_nowait() == 0
+
+    # Synchronous runs which would otherwise receive an unawaited coroutine are rejected
+    for method in (proc.coroutine, lambda: proc.run_function([1]),
+        lambda: proc.attach_prefix(1, (20,))):
+        try:
+            method()
+            assert False
+        except RuntimeError:
+            pass
+
+    logging.info("Async processor test cases completed OK")
+
+def test_network():
+
+    # Machine 0 sends a packet to machine 1, and each machine forwards packets it receives to
+    # the next address with y incremented, the last sending to address 255 outside the
+    # network. On idle, the packet last sent outside the network is sent to machine 0
+    test_program = [
+        3,100, 1008,100,0,101, 1006,101,15, 104,1, 104,0, 104,0,
+        3,102, 1008,102,-1,101, 1005,101,15, 3,103,
+        1001,100,1,104, 1007,104,4,101, 1005,101,41, 1101,0,255,104,
+        4,104, 4,102, 1001,103,1,103, 4,103, 1105,1,15,
+    ]
+
+    for num_shards in (1, 2):
+        external_packets = []
+        def receive(dest, x, y):
+            external_packets.append((dest, x, y))
+        def resend(network):
+            if len(external_packets) == 3:
+                network.stop()
+            else:
+                network.send(0, *external_packets[-1][1:])
+
+        with Network(test_program, 4, instruction_budget=10, num_shards=num_shards) as network:
+            network.attach_external_method(receive)
+            network.attach_idle_method(resend)
+            network.run()
+        assert external_packets == [(255, 0, 3), (255, 0, 7), (255, 0, 11)]
+
+    logging.info("Network test cases completed OK")
+
 def run_part_with_inputs(proc, inputs):
 
     proc.reset_memory()
@@ -541,10 +3165,24 @@ def main():
         level=log_level, format='%(levelname)-8s: %(message)s', datefmt='%H:%M:%S'
     )
 
-    proc = IntCodeProcessor()
-    proc.self_test_basic()
-    proc.self_test_part1()
-    proc.self_test_part2()
+    for engine in IntCodeProcessor.Engine:
+        proc = IntCodeProcessor(engine=engine)
+        proc.self_test_basic()
+        proc.self_test_part1()
+        proc.self_test_part2()
+        proc.self_test_replay()
+        proc.self_test_trace()
+        proc.self_test_step_until()
+        proc.self_test_hot_blocks()
+        proc.self_test_function()
+        proc.self_test_batch()
+        proc.self_test_snapshot()
+        proc.self_test_profiler()
+    test_program_image()
+    test_processor_pool()
+    test_async_outputs()
+    test_async_processor()
+    test_network()
 
     proc.load_file('input_5.txt')
     part1(proc)
@@ -0,0 +1,664 @@
+# IntCode static analysis - disassembly, basic blocks and control flow graph
+
+import collections
+import functools
+import logging
+import sys
+
+from intcode import FunctionCache, IntCodeProcessor
+
+Opcode = IntCodeProcessor.Opcode
+ParamMode = IntCodeProcessor.ParamMode
+
+Instruction = collections.namedtuple(
+    'Instruction', ['addr', 'opcode', 'param_modes', 'params', 'length']
+)
+
+InputPrefix = collections.namedtuple('InputPrefix', ['num_instructions', 'input_addrs'])
+
+class BasicBlock(object):
+
+    def __init__(self, start):
+
+        self.start = start
+        self.end = start
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+        self.indirect = False
+
+    def add_instruction(self, instruction):
+
+        self.instructions.append(instruction)
+        self.end = instruction.addr + instruction.length
+
+    def get_terminator(self):
+
+        return self.instructions[-1]
+
+class ProgramModel(object):
+
+    Mnemonics = {
+        Opcode.ADD:        'ADD',
+        Opcode.MULTIPLY:   'MUL',
+        Opcode.INPUT:      'INP',
+        Opcode.OUTPUT:     'OUT',
+        Opcode.JUMP_TRUE:  'JNE',
+        Opcode.JUMP_FALSE: 'JEQ',
+        Opcode.LESS_THAN:  'LT',
+        Opcode.EQUALS:     'EQ',
+        Opcode.ADJ_REL:    'ADJ',
+        Opcode.HALT:       'HALT',
+    }
+
+    # Instructions and the index of the parameter they write to
+    OutputParams = {
+        Opcode.ADD:       2,
+        Opcode.MULTIPLY:  2,
+        Opcode.INPUT:     0,
+        Opcode.LESS_THAN: 2,
+        Opcode.EQUALS:    2,
+    }
+
+    JumpOpcodes = (Opcode.JUMP_TRUE, Opcode.JUMP_FALSE)
+
+    def __init__(self, program):
+
+        self.program = program
+
+        self.parser = IntCodeProcessor()
+        self.instruction_lens = {
+            opcode: instruction[1] for (opcode, instruction) in self.parser.instructions.items()
+        }
+
+        self.instructions = {}
+        self.entry_points = set([0])
+        self.return_sites = set()
+        self.jump_targets = set()
+        self.indirect_jumps = set()
+        self.invalid_addrs = set()
+        self.code_addrs = set()
+        self.blocks = {}
+        self.self_modifying_writes = []
+
+        self._disassemble()
+        self._build_blocks()
+        self._find_self_modifying_writes()
+
+    def _decode(self, addr):
+
+        # Decode the instruction at the address, returning None if it is not a valid
+        # instruction lying entirely within the program
+        if not 0 <= addr < len(self.program):
+            return None
+        try:
+            (opcode, param_modes) = self.parser._parse_instruction(self.program[addr])
+            length = self.instruction_lens[opcode]
+        except (KeyError, ValueError):
+            return None
+        if addr + length > len(self.program):
+            return None
+
+        return Instruction(
+            addr, Opcode(opcode), tuple(param_modes[:length-1]),
+            tuple(self.program[addr+1:addr+length]), length
+        )
+
+    def _disassemble(self):
+
+        # Recursively traverse the program from its entry points, following fall through and
+        # jumps to immediate targets. Regions never reached are treated as data
+        pending = list(self.entry_points)
+
+        while pending:
+            addr = pending.pop()
+            while addr not in self.instructions:
+
+                instruction = self._decode(addr)
+                if instruction is None:
+                    logging.debug("Invalid instruction reached at address {}".format(addr))
+                    self.invalid_addrs.add(addr)
+                    break
+
+                self.instructions[addr] = instruction
+                self.code_addrs.update(range(addr, addr + instruction.length))
+
+                # A constant computed immediately before an unconditional jump and pushed to the
+                # stack is the return address of a call, so is also an entry point
+                return_site = self._get_return_site(instruction)
+                if return_site is not None:
+                    self.return_sites.add(return_site)
+                    self.entry_points.add(return_site)
+                    pending.append(return_site)
+
+                (targets, falls_through) = self._get_flow(instruction)
+                for target in targets:
+                    self.jump_targets.add(target)
+                    pending.append(target)
+
+                if not falls_through:
+                    break
+                addr += instruction.length
+
+    def _get_flow(self, instruction):
+
+        # Return the static jump targets of the instruction and whether execution can fall
+        # through to the next instruction
+        opcode = instruction.opcode
+
+        if opcode == Opcode.HALT:
+            return ([], False)
+
+        if opcode not in self.JumpOpcodes:
+            return ([], True)
+
+        # Jump conditions which are immediate are resolved statically, so that unconditional
+        # jumps do not fall through and jumps which are never taken have no target
+        (cond_mode, target_mode) = instruction.param_modes
+        (cond, target) = instruction.params
+        (may_jump, may_fall_through) = (True, True)
+        if cond_mode == ParamMode.IMMEDIATE:
+            may_jump = (cond != 0) == (opcode == Opcode.JUMP_TRUE)
+            may_fall_through = not may_jump
+
+        targets = []
+        if may_jump:
+            if target_mode == ParamMode.IMMEDIATE:
+                targets.append(target)
+            else:
+                self.indirect_jumps.add(instruction.addr)
+
+        return (targets, may_fall_through)
+
+    def _get_return_site(self, instruction):
+
+        if instruction.opcode not in (Opcode.ADD, Opcode.MULTIPLY):
+            return None
+        if instruction.param_modes[:2] != (ParamMode.IMMEDIATE, ParamMode.IMMEDIATE) or \
+            instruction.param_modes[2] != ParamMode.RELATIVE:
+            return None
+
+        jump = self._decode(instruction.addr + instruction.length)
+        if jump is None or jump.opcode not in self.JumpOpcodes:
+            return None
+        (targets, falls_through) = self._get_flow(jump)
+        if falls_through:
+            return None
+
+        (value_1, value_2) = instruction.params[:2]
+        value = value_1 + value_2 if instruction.opcode == Opcode.ADD else value_1 * value_2
+        if self._decode(value) is None:
+            return None
+
+        return value
+
+    def _build_blocks(self):
+
+        # Blocks start at entry points, jump targets, after any jump and wherever the
+        # disassembled code is not contiguous, and end at jumps and halts
+        leaders = self.entry_points | self.jump_targets
+        block = None
+
+        for addr in sorted(self.instructions):
+            instruction = self.instructions[addr]
+            if block is None or addr in leaders or addr != block.end:
+                block = BasicBlock(addr)
+                self.blocks[addr] = block
+            block.add_instruction(instruction)
+
+            if instruction.opcode in self.JumpOpcodes or instruction.opcode == Opcode.HALT:
+                block = None
+
+        # Link blocks to their successors by jump target and fall through
+        for block in self.blocks.values():
+            terminator = block.get_terminator()
+            (targets, falls_through) = self._get_flow(terminator)
+            if falls_through and block.end in self.blocks:
+                targets = targets + [block.end]
+            block.indirect = terminator.addr in self.indirect_jumps
+
+            for target in targets:
+                if target in self.blocks and target not in block.successors:
+                    block.successors.append(target)
+                    self.blocks[target].predecessors.append(block.start)
+
+    def _find_self_modifying_writes(self):
+
+        # Flag instructions writing to an absolute address within the disassembled code, or
+        # where an invalid instruction was reached, since that is presumably written before it
+        # is executed. Relative writes cannot be resolved statically
+        for instruction in self.instructions.values():
+            param_idx = self.OutputParams.get(instruction.opcode)
+            if param_idx is None or instruction.param_modes[param_idx] == ParamMode.RELATIVE:
+                continue
+
+            write_addr = instruction.params[param_idx]
+            if write_addr in self.code_addrs or write_addr in self.invalid_addrs:
+                self.self_modifying_writes.append((instruction.addr, write_addr))
+
+        self.self_modifying_writes.sort()
+
+    def get_block(self, addr):
+
+        # Return the block containing the address, if any
+        for block in self.blocks.values():
+            if block.start <= addr < block.end:
+                return block
+        return None
+
+    def find_loops(self):
+
+        # Find the natural loops of the control flow graph, from the back edges found by a
+        # depth first search from the entry points, merging loops with the same header.
+        # Returns a list of (header, body) tuples where the body is the set of block start
+        # addresses in the loop, largest first
+        back_edges = []
+        visited = set()
+        on_stack = set()
+
+        for entry in sorted(self.entry_points):
+            if entry not in self.blocks or entry in visited:
+                continue
+            visited.add(entry)
+            on_stack.add(entry)
+            stack = [(entry, iter(self.blocks[entry].successors))]
+            while stack:
+                (start, successors) = stack[-1]
+                successor = next(successors, None)
+                if successor is None:
+                    on_stack.discard(start)
+                    stack.pop()
+                elif successor in on_stack:
+                    back_edges.append((start, successor))
+                elif successor not in visited:
+                    visited.add(successor)
+                    on_stack.add(successor)
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+
+        loops = {}
+        for (tail, header) in back_edges:
+            body = loops.setdefault(header, set([header]))
+            body.add(tail)
+            pending = [tail]
+            while pending:
+                start = pending.pop()
+                if start == header:
+                    continue
+                for predecessor in self.blocks[start].predecessors:
+                    if predecessor not in body:
+                        body.add(predecessor)
+                        pending.append(predecessor)
+
+        return sorted(loops.items(), key=lambda loop: len(loop[1]), reverse=True)
+
+    def format_instruction(self, instruction):
+
+        operands = []
+        for (param, mode) in zip(instruction.params, instruction.param_modes):
+            if mode == ParamMode.IMMEDIATE:
+                operands.append("%x" % param)
+            elif mode == ParamMode.RELATIVE:
+                operands.append("[rb%+x]" % param)
+            else:
+                operands.append("[%x]" % param)
+
+        return "%04x: %-4s %s" % (
+            instruction.addr, self.Mnemonics[instruction.opcode], ' '.join(operands)
+        )
+
+    def disassemble(self):
+
+        # Return the disassembly listing of the program, labelling the start of each block
+        # with its successors
+        lines = []
+        for start in sorted(self.blocks):
+            block = self.blocks[start]
+            lines.append("block %04x -> %s%s" % (
+                start, ' '.join("%04x" % succ for succ in block.successors),
+                " (indirect)" if block.indirect else ""
+            ))
+            for instruction in block.instructions:
+                lines.append("    " + self.format_instruction(instruction))
+
+        return lines
+
+@functools.lru_cache(maxsize=16)
+def _analyse_program(program):
+
+    return ProgramModel(list(program))
+
+def analyse_program(program):
+
+    # Return the model of the program, which is only computed once for a given program
+    return _analyse_program(tuple(program))
+
+class AffineExpression(object):
+
+    # An expression over named symbols of the form constant + sum(coeff * symbol)
+    def __init__(self, constant=0, coeffs={}):
+
+        self.constant = constant
+        self.coeffs = {symbol: coeff for (symbol, coeff) in coeffs.items() if coeff != 0}
+
+    def is_constant(self):
+
+        return not self.coeffs
+
+    def add(self, other):
+
+        coeffs = dict(self.coeffs)
+        for (symbol, coeff) in other.coeffs.items():
+            coeffs[symbol] = coeffs.get(symbol, 0) + coeff
+
+        return AffineExpression(self.constant + other.constant, coeffs)
+
+    def multiply(self, other):
+
+        # The product is only affine if at least one of the expressions is a constant
+        (expression, factor) = (self, other) if other.is_constant() else (other, self)
+        if not factor.is_constant():
+            return None
+
+        return AffineExpression(
+            expression.constant * factor.constant,
+            {symbol: coeff * factor.constant for (symbol, coeff) in expression.coeffs.items()}
+        )
+
+    def evaluate(self, values):
+
+        return self.constant + sum(
+            coeff * values[symbol] for (symbol, coeff) in self.coeffs.items()
+        )
+
+    def __str__(self):
+
+        terms = ["{}*{}".format(coeff, symbol) for (symbol, coeff) in sorted(self.coeffs.items())]
+        return ' + '.join(terms + [str(self.constant)])
+
+def evaluate_symbolic(program, symbols, output_addr=0):
+
+    # Symbolically execute a straight-line program of additions and multiplications, with the
+    # memory addresses in the symbols dict holding the named symbols rather than values, and
+    # return the affine expression for the value at the output address. Values which cannot
+    # be expressed, i.e. products of symbols or reads from a symbolic address, are held as
+    # None. Returns None if the output is not affine, or the program is not straight-line
+    parser = IntCodeProcessor()
+    memory = [AffineExpression(value) for value in program]
+    for (addr, symbol) in symbols.items():
+        memory[addr] = AffineExpression(coeffs={symbol: 1})
+
+    def get_addr(param):
+        if param is None or not param.is_constant() or param.constant < 0:
+            return None
+        if param.constant >= len(memory):
+            memory.extend([AffineExpression(0)] * (param.constant + 1 - len(memory)))
+        return param.constant
+
+    ptr = 0
+    while ptr < len(program):
+
+        word = memory[ptr]
+        if word is None or not word.is_constant():
+            logging.debug("Symbolic instruction reached at address {}".format(ptr))
+            return None
+        try:
+            (opcode, param_modes) = parser._parse_instruction(word.constant)
+        except ValueError:
+            return None
+
+        if opcode == Opcode.HALT:
+            break
+        if opcode not in (Opcode.ADD, Opcode.MULTIPLY) or ptr + 4 > len(memory) or \
+            any(mode == ParamMode.RELATIVE for mode in param_modes[:3]) or \
+            param_modes[2] == ParamMode.IMMEDIATE:
+            logging.debug("Non-arithmetic instruction {} reached at address {}".format(
+                word.constant, ptr
+            ))
+            return None
+
+        values = []
+        for (param, mode) in zip(memory[ptr+1:ptr+3], param_modes[:2]):
+            if mode == ParamMode.IMMEDIATE:
+                values.append(param)
+            else:
+                addr = get_addr(param)
+                values.append(None if addr is None else memory[addr])
+
+        result = None
+        if None not in values:
+            if opcode == Opcode.ADD:
+                result = values[0].add(values[1])
+            else:
+                result = values[0].multiply(values[1])
+
+        output_ptr = get_addr(memory[ptr+3])
+        if output_ptr is None:
+            logging.debug("Write to a symbolic address at address {}".format(ptr))
+            return None
+        memory[output_ptr] = result
+        ptr += 4
+
+    return memory[output_addr] if output_addr < len(memory) else None
+
+def solve_noun_verb(program, target, max_value=99):
+
+    # Solve for the noun and verb, written to addresses 1 and 2, giving the target output at
+    # address 0, returning the first solution in order of noun then verb, as a grid search
+    # would. Returns None if the program is not affine in the noun and verb, or there is no
+    # solution in range
+    expression = evaluate_symbolic(program, {1: 'noun', 2: 'verb'})
+    if expression is None:
+        return None
+    logging.debug("Program output is {}".format(expression))
+
+    values_range = range(0, max_value + 1)
+    coeff = expression.coeffs.get('verb', 0)
+    for noun in values_range:
+        remainder = target - expression.evaluate({'noun': noun, 'verb': 0})
+        if coeff == 0:
+            if remainder != 0:
+                continue
+            verb = 0
+        elif remainder % coeff != 0 or remainder // coeff not in values_range:
+            continue
+        else:
+            verb = remainder // coeff
+
+        # Check the solution concretely, since the program is only modelled, not run
+        proc = IntCodeProcessor(program, features=IntCodeProcessor.Feature.BASIC)
+        proc.set_noun(noun)
+        proc.set_verb(verb)
+        if proc.run() != target:
+            logging.debug("Solution noun {} verb {} not confirmed".format(noun, verb))
+            return None
+        return (noun, verb)
+
+    return None
+
+@functools.lru_cache(maxsize=16)
+def _find_input_prefix(program, max_instructions):
+
+    parser = IntCodeProcessor()
+    memory = collections.defaultdict(int, enumerate(program))
+    tainted = set()
+    (ptr, relative_base) = (0, 0)
+    input_addrs = []
+    num_instructions = 0
+
+    while num_instructions < max_instructions and 0 <= ptr < len(program):
+
+        if ptr in tainted:
+            break
+        try:
+            (opcode, param_modes) = parser._parse_instruction(memory[ptr])
+            length = parser.instructions[opcode][1]
+        except (KeyError, ValueError):
+            break
+        if opcode == Opcode.HALT:
+            break
+
+        # Resolve the parameter addresses, which must not depend on input. Immediate
+        # parameters are read from the parameter cell itself
+        param_cells = range(ptr + 1, ptr + length)
+        if any(cell in tainted for cell in param_cells):
+            break
+        addrs = []
+        for (cell, mode) in zip(param_cells, param_modes):
+            if mode == ParamMode.IMMEDIATE:
+                addrs.append(cell)
+            elif mode == ParamMode.RELATIVE:
+                addrs.append(relative_base + memory[cell])
+            else:
+                addrs.append(memory[cell])
+        if any(addr < 0 for addr in addrs):
+            break
+
+        # The instruction depends on input if any value it reads does
+        output_idx = ProgramModel.OutputParams.get(opcode)
+        read_addrs = [addr for (idx, addr) in enumerate(addrs) if idx != output_idx]
+        if any(addr in tainted for addr in read_addrs):
+            break
+        values = [memory[addr] for addr in read_addrs]
+
+        # The prefix also ends at an instruction overwriting an input, since the inputs are
+        # written to their addresses after the state at the end of the prefix is restored
+        if output_idx is not None and addrs[output_idx] in tainted:
+            break
+
+        if opcode == Opcode.INPUT:
+            input_addrs.append(addrs[0])
+            tainted.add(addrs[0])
+            memory[addrs[0]] = 0
+        elif output_idx is not None:
+            memory[addrs[output_idx]] = {
+                Opcode.ADD:       lambda value_1, value_2: value_1 + value_2,
+                Opcode.MULTIPLY:  lambda value_1, value_2: value_1 * value_2,
+                Opcode.LESS_THAN: lambda value_1, value_2: int(value_1 < value_2),
+                Opcode.EQUALS:    lambda value_1, value_2: int(value_1 == value_2),
+            }[opcode](*values)
+        elif opcode == Opcode.ADJ_REL:
+            relative_base += values[0]
+
+        num_instructions += 1
+        if opcode in ProgramModel.JumpOpcodes and (values[0] != 0) == (opcode == Opcode.JUMP_TRUE):
+            ptr = values[1]
+        else:
+            ptr += length
+
+    return InputPrefix(num_instructions, tuple(input_addrs))
+
+def find_input_prefix(program, max_instructions=1000000):
+
+    # Find the input-independent prefix of the program, by executing it from its initial state
+    # tracking the memory cells tainted by input values, until reaching an instruction which
+    # reads or writes a tainted cell, or is itself tainted, or a halt. Since the program state
+    # only varies with the inputs through the tainted cells, the prefix executes identically
+    # whatever the inputs. Returns the number of instructions in the prefix and the addresses
+    # the inputs it reads are written to
+    return _find_input_prefix(tuple(program), max_instructions)
+
+def test_analysis():
+
+    # A counting loop, a call to a function returning through the stack and a write to
+    # the parameter of an instruction
+    test_program = [
+        1101,0,0,40,        # 00: [40] = 0
+        1001,40,1,40,       # 04: [40] += 1
+        1007,40,5,41,       # 08: [41] = [40] < 5
+        1005,41,4,          # 12: loop while [41]
+        109,50,             # 15: rb = 50
+        21101,0,24,0,       # 17: push return address 24
+        1105,1,26,          # 21: call 26
+        99,0,               # 24: halt
+        1101,0,0,31,        # 26: write condition parameter of return
+        2106,0,0,           # 30: return
+    ]
+    model = analyse_program(test_program)
+
+    assert sorted(model.blocks) == [0, 4, 15, 24, 26]
+    assert model.blocks[4].successors == [4, 15]
+    assert model.blocks[15].successors == [26]
+    assert model.blocks[26].indirect
+    assert model.return_sites == set([24])
+    assert model.find_loops() == [(4, set([4]))]
+    assert model.self_modifying_writes == [(26, 31)]
+
+    # A word with more parameter modes than any instruction does not decode, whether
+    # reached by disassembly or as a candidate return site
+    model = analyse_program([21101,0,7,0, 1105,1,8, 1111199, 99])
+    assert sorted(model.blocks) == [0, 8]
+    assert model.return_sites == set()
+    assert find_input_prefix([1101,1,2,20, 1111199]) == InputPrefix(1, ())
+    assert evaluate_symbolic([1,2,0,0, 1111199], {2: 'noun'}) is None
+
+    # The first instruction reads from the noun and verb addresses, but its result is
+    # overwritten by their sum, which is tripled to give an output of 3*noun + 3*verb
+    test_program = [1,0,0,3, 1,1,2,3, 2,3,13,0, 99, 3]
+    assert str(evaluate_symbolic(test_program, {1: 'noun', 2: 'verb'})) == \
+        "3*noun + 3*verb + 0"
+    assert solve_noun_verb(test_program, 51) == (0, 17)
+    assert solve_noun_verb(test_program, 52) is None
+    assert solve_noun_verb([1,0,0,3, 2,1,2,0, 99], 10) is None
+    assert solve_noun_verb([1,0,0,3, 1105,1,0, 99], 10) is None
+
+    # Reading both inputs, the second relative to the base, and adding a constant, is input
+    # independent, but the sum of the inputs is not. The prefix of a program which does not
+    # read its inputs extends to the halt
+    test_program = [3,20, 109,5, 203,16, 1101,2,3,22, 1,20,21,23, 4,23, 99]
+    prefix = find_input_prefix(test_program)
+    assert prefix == InputPrefix(4, (20, 21))
+    assert find_input_prefix([3,5, 104,7, 99]) == InputPrefix(2, (5,))
+    assert find_input_prefix([1005,9,5, 104,1, 104,2, 99, 0, 0]) == InputPrefix(3, ())
+    assert find_input_prefix([3,20, 1101,5,0,20, 3,21, 1,20,21,22, 4,22, 99]) == \
+        InputPrefix(1, (20,))
+
+    proc = IntCodeProcessor(test_program)
+    proc.attach_prefix(*prefix)
+    cache = FunctionCache()
+    assert proc.run_function([30, 12], cache=cache) == (42,)
+    assert proc.run_function([5, 6], cache=cache) == (11,)
+    assert proc.run_function([5, 6], patches={10: 2}, cache=cache) == (30,)
+
+    # An input overwritten within the program is not written over the value replacing it
+    test_program = [3,20, 1101,5,0,20, 3,21, 1,20,21,22, 4,22, 99]
+    proc = IntCodeProcessor(test_program)
+    proc.attach_prefix(*find_input_prefix(test_program))
+    assert proc.run_function([7, 1], cache=cache) == (6,)
+
+    logging.info("Analysis test cases completed OK")
+
+def main():
+
+    log_level = logging.INFO
+    try:
+        if int(sys.argv[1]):
+            log_level = logging.DEBUG
+    except (ValueError, IndexError):
+        pass
+
+    logging.basicConfig(
+        level=log_level, format='%(levelname)-8s: %(message)s', datefmt='%H:%M:%S'
+    )
+
+    test_analysis()
+
+    proc = IntCodeProcessor()
+    for day in (5, 9, 11, 13, 15, 17, 19):
+        proc.load_file('input_{}.txt'.format(day))
+        model = analyse_program(proc.program)
+        loops = model.find_loops()
+        logging.info(
+            "Day {}: {} instructions in {} blocks, {} loops, {} indirect jumps, "
+            "{} self-modifying writes".format(
+                day, len(model.instructions), len(model.blocks), len(loops),
+                len(model.indirect_jumps), len(model.self_modifying_writes)
+            )
+        )
+        for (header, body) in loops[:3]:
+            logging.info("  Loop at {:04x} over {} blocks".format(header, len(body)))
+        for line in model.disassemble():
+            logging.debug(line)
+
+
+if __name__ == '__main__':
+    main()